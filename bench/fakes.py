@@ -0,0 +1,484 @@
+import asyncio
+import copy
+import itertools
+import random
+import re
+from collections import OrderedDict
+from types import SimpleNamespace
+
+from bson.objectid import ObjectId
+from pymongo.errors import OperationFailure
+from pyrogram.types import CallbackQuery, Message
+
+from pager import BSON_SORT_ORDER, bson_sort_type
+
+
+# Telegram side: just enough of Client, Message and CallbackQuery for the handlers and
+# Pyrogram's own filters. Every outbound call is counted and can carry simulated latency.
+
+# Users scroll up and tap buttons on older messages too, so a few keyboards per chat stay tappable
+KEYBOARD_HISTORY = 20
+
+class FakeClient:
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.me = SimpleNamespace(id=0, username="bench_bot")
+        self.calls = {}
+        self.keyboards = {}
+        self.texts = {}
+        self.answers = {}
+        self._message_ids = itertools.count(1)
+
+    async def _record(self, method, chat_id, text=None, reply_markup=None, message_id=None):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if message_id is None:
+            message_id = next(self._message_ids)
+        if text is not None:
+            self.texts[chat_id] = text
+        if reply_markup is not None:
+            keyboards = self.keyboards.setdefault(chat_id, OrderedDict())
+            keyboards.pop(message_id, None)
+            keyboards[message_id] = reply_markup
+            while len(keyboards) > KEYBOARD_HISTORY:
+                keyboards.popitem(last=False)
+        return message_id
+
+    def sent(self):
+        return sum(self.calls.values())
+
+    async def send_message(self, chat_id, text, reply_markup=None, **kwargs):
+        message_id = await self._record("send_message", chat_id, text, reply_markup)
+        return FakeMessage(self, chat_id, chat_id, text, message_id=message_id)
+
+    async def edit_message_text(self, chat_id, message_id, text, reply_markup=None, **kwargs):
+        if reply_markup is None:
+            # Telegram drops the inline keyboard when an edit doesn't carry one
+            self.keyboards.get(chat_id, {}).pop(message_id, None)
+        await self._record("edit_message_text", chat_id, text, reply_markup, message_id)
+        return FakeMessage(self, chat_id, chat_id, text, message_id=message_id)
+
+    async def send_document(self, chat_id, document, reply_markup=None, **kwargs):
+        message_id = await self._record("send_document", chat_id, kwargs.get("caption"), reply_markup)
+        return FakeMessage(self, chat_id, chat_id, None, message_id=message_id)
+
+    async def answer_callback_query(self, callback_query_id, text=None, show_alert=False, **kwargs):
+        if text:
+            self.answers[text] = self.answers.get(text, 0) + 1
+        await self._record("answer_callback_query", None)
+        return True
+
+    async def get_me(self):
+        return self.me
+
+
+class FakeMessage(Message):
+    # Message.__init__ needs a full Telegram payload; only the fields filters and handlers read are set
+    def __init__(self, client, user_id, chat_id, text, message_id=0):
+        self._client = client
+        self.id = message_id
+        self.from_user = SimpleNamespace(id=user_id)
+        self.chat = SimpleNamespace(id=chat_id)
+        self.text = text
+        self.caption = None
+        self.document = None
+        self.matches = None
+        self.command = None
+
+    async def reply_text(self, text, reply_markup=None, **kwargs):
+        return await self._client.send_message(self.chat.id, text, reply_markup=reply_markup)
+
+
+class FakeCallbackQuery(CallbackQuery):
+    _ids = itertools.count(1)
+
+    def __init__(self, client, user_id, message, data):
+        self._client = client
+        self.id = str(next(self._ids))
+        self.from_user = SimpleNamespace(id=user_id)
+        self.message = message
+        self.data = data
+        self.matches = None
+
+    async def answer(self, text=None, show_alert=False, **kwargs):
+        return await self._client.answer_callback_query(self.id, text=text, show_alert=show_alert)
+
+    async def edit_message_text(self, text, reply_markup=None, **kwargs):
+        self.message.text = text
+        return await self._client.edit_message_text(self.message.chat.id, self.message.id, text, reply_markup=reply_markup)
+
+
+# Mongo side: an in-memory stand-in for the slice of Motor the bot uses. Each operation
+# awaits the configured latency so handlers interleave the way they do against a server.
+
+def get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict) or part not in value:
+            return None, False
+        value = value[part]
+    return value, True
+
+
+def compare(value, operator, operand):
+    try:
+        if operator == "$gt":
+            return value > operand
+        if operator == "$gte":
+            return value >= operand
+        if operator == "$lt":
+            return value < operand
+        if operator == "$lte":
+            return value <= operand
+    except TypeError:
+        return False
+    raise OperationFailure(f"unknown operator: {operator}")
+
+
+def match_field(document, field, condition):
+    value, present = get_path(document, field)
+    values = value if isinstance(value, list) else [value]
+    if not (isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition)):
+        return present and (value == condition or condition in values)
+    for operator, operand in condition.items():
+        if operator == "$exists":
+            ok = present == bool(operand)
+        elif operator == "$eq":
+            ok = present and (value == operand or operand in values)
+        elif operator == "$ne":
+            ok = not present or (value != operand and operand not in values)
+        elif operator == "$in":
+            ok = present and any(item in operand for item in values)
+        elif operator == "$nin":
+            ok = not present or not any(item in operand for item in values)
+        elif operator == "$type":
+            kinds = operand if isinstance(operand, list) else [operand]
+            ok = present and sort_type(value) in kinds
+        elif operator == "$regex":
+            ok = present and any(isinstance(item, str) and re.search(operand, item) for item in values)
+        else:
+            ok = present and any(compare(item, operator, operand) for item in values)
+        if not ok:
+            return False
+    return True
+
+
+def matches(document, query):
+    for field, condition in (query or {}).items():
+        if field == "$and":
+            ok = all(matches(document, clause) for clause in condition)
+        elif field == "$or":
+            ok = any(matches(document, clause) for clause in condition)
+        elif field.startswith("$"):
+            raise OperationFailure(f"unknown top level operator: {field}")
+        else:
+            ok = match_field(document, field, condition)
+        if not ok:
+            return False
+    return True
+
+
+_SORT_TYPES = {}
+
+
+def sort_type(value):
+    # bson_sort_type per Python type, cached since the stand-in calls it for every document
+    kind = type(value)
+    if kind not in _SORT_TYPES:
+        _SORT_TYPES[kind] = bson_sort_type(value)
+    return _SORT_TYPES[kind]
+
+
+def sort_rank(value):
+    return BSON_SORT_ORDER.index(sort_type(value))
+
+
+def sort_key(field):
+    if field == "_id":
+        # Types group in BSON order; within one type the values compare directly
+        return lambda document: (sort_rank(document["_id"]), document["_id"])
+
+    def key(document):
+        value, present = get_path(document, field)
+        # Missing fields sort first, and mixed types group by type name like BSON ordering roughly does
+        return (present, type(value).__name__, value if present else 0)
+    return key
+
+
+def project(document, projection):
+    if not projection:
+        return document
+    include = {field for field, flag in projection.items() if flag and field != "_id"}
+    if include:
+        result = {field: document[field] for field in include if field in document}
+        if projection.get("_id", 1):
+            result["_id"] = document["_id"]
+        return result
+    return {field: value for field, value in document.items() if projection.get(field, 1)}
+
+
+def apply_update(document, update):
+    if isinstance(update, list):
+        raise OperationFailure("pipeline updates are not supported by the benchmark stand-in")
+    for operator, fields in update.items():
+        for field, value in fields.items():
+            if operator == "$set":
+                document[field] = value
+            elif operator == "$unset":
+                document.pop(field, None)
+            elif operator == "$inc":
+                document[field] = document.get(field, 0) + value
+            else:
+                raise OperationFailure(f"unknown update operator: {operator}")
+
+
+class FakeCursor:
+    def __init__(self, collection, query, projection=None, sort=None):
+        self._collection = collection
+        self._query = query
+        self._projection = projection
+        self._sort = list(sort or [])
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        self._sort = list(key) if isinstance(key, list) else [(key, direction)]
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    async def to_list(self, length=None):
+        await self._collection.database.client.wait()
+        documents = list(self._collection.documents)
+        for field, direction in reversed(self._sort):
+            documents.sort(key=sort_key(field), reverse=direction == -1)
+        # Sorting first lets the filter stop at the last document the page needs, roughly
+        # like an index scan would
+        wanted = min([limit for limit in (self._limit, length) if limit] or [len(documents)])
+        skip = self._skip
+        results = []
+        for document in documents:
+            if len(results) >= wanted:
+                break
+            if self._query and not matches(document, self._query):
+                continue
+            if skip:
+                skip -= 1
+                continue
+            results.append(document)
+        return [copy.deepcopy(project(document, self._projection)) for document in results]
+
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.documents = []
+
+    def find(self, query=None, projection=None, sort=None, max_time_ms=None, **kwargs):
+        return FakeCursor(self, query, projection, sort)
+
+    async def count_documents(self, query, **kwargs):
+        await self.database.client.wait()
+        return sum(1 for document in self.documents if matches(document, query))
+
+    async def estimated_document_count(self, **kwargs):
+        await self.database.client.wait()
+        return len(self.documents)
+
+    async def insert_one(self, document):
+        await self.database.client.wait()
+        document.setdefault("_id", ObjectId())
+        self.documents.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_id=document["_id"])
+
+    async def insert_many(self, documents, ordered=True):
+        await self.database.client.wait()
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            self.documents.append(copy.deepcopy(document))
+        return SimpleNamespace(inserted_ids=[document["_id"] for document in documents])
+
+    async def update_one(self, query, update):
+        await self.database.client.wait()
+        for document in self.documents:
+            if matches(document, query):
+                apply_update(document, update)
+                return SimpleNamespace(matched_count=1, modified_count=1)
+        return SimpleNamespace(matched_count=0, modified_count=0)
+
+    async def delete_one(self, query):
+        await self.database.client.wait()
+        for i, document in enumerate(self.documents):
+            if matches(document, query):
+                del self.documents[i]
+                return SimpleNamespace(deleted_count=1)
+        return SimpleNamespace(deleted_count=0)
+
+    async def delete_many(self, query):
+        await self.database.client.wait()
+        kept = [document for document in self.documents if not matches(document, query)]
+        deleted = len(self.documents) - len(kept)
+        self.documents = kept
+        return SimpleNamespace(deleted_count=deleted)
+
+    def aggregate(self, pipeline, **kwargs):
+        return FakeAggregation(self, pipeline)
+
+    def list_indexes(self):
+        return FakeResult(self, [{"name": "_id_", "key": {"_id": 1}}])
+
+    async def create_index(self, keys, **options):
+        await self.database.client.wait()
+        return options.get("name") or "_".join(f"{field}_{kind}" for field, kind in keys)
+
+
+class FakeResult:
+    def __init__(self, collection, documents):
+        self._collection = collection
+        self._documents = documents
+
+    async def to_list(self, length=None):
+        await self._collection.database.client.wait()
+        return self._documents[:length] if length else list(self._documents)
+
+
+class FakeAggregation:
+    def __init__(self, collection, pipeline):
+        self._collection = collection
+        self._pipeline = pipeline
+        self._results = None
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._results is None:
+            self._results = iter(await self.to_list())
+        try:
+            return next(self._results)
+        except StopIteration:
+            raise StopAsyncIteration from None
+
+    async def close(self):
+        pass
+
+    async def to_list(self, length=None):
+        await self._collection.database.client.wait()
+        documents = self._collection.documents
+        for stage in self._pipeline:
+            (name, spec), = stage.items()
+            if name == "$match":
+                documents = [document for document in documents if matches(document, spec)]
+            elif name == "$group" and spec["_id"] is None:
+                group = {"_id": None}
+                for field, accumulator in spec.items():
+                    if field == "_id":
+                        continue
+                    operand = accumulator["$sum"]
+                    if isinstance(operand, str):
+                        values = (get_path(document, operand[1:])[0] for document in documents)
+                        group[field] = sum(value for value in values if isinstance(value, (int, float)))
+                    else:
+                        group[field] = operand * len(documents)
+                documents = [group] if documents else []
+            elif name == "$sample":
+                documents = random.sample(documents, min(spec["size"], len(documents)))
+            elif name == "$collStats":
+                size = sum(len(repr(document)) for document in documents)
+                documents = [{"storageStats": {
+                    "count": len(documents), "size": size, "storageSize": size, "totalIndexSize": 0, "nindexes": 1,
+                }}]
+            elif name == "$indexStats":
+                documents = []
+            else:
+                raise OperationFailure(f"{name} is not supported by the benchmark stand-in")
+        documents = copy.deepcopy(documents)
+        return documents[:length] if length else documents
+
+
+class FakeDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.collections = {}
+
+    def __getitem__(self, name):
+        collection = self.collections.get(name)
+        if collection is None:
+            collection = self.collections[name] = FakeCollection(self, name)
+        return collection
+
+    async def list_collection_names(self):
+        await self.client.wait()
+        return list(self.collections)
+
+    async def create_collection(self, name):
+        await self.client.wait()
+        return self[name]
+
+    async def drop_collection(self, name):
+        await self.client.wait()
+        self.collections.pop(name, None)
+
+    async def command(self, name, *args, **kwargs):
+        if name != "explain":
+            await self.client.wait()
+            raise OperationFailure(f"{name} is not supported by the benchmark stand-in")
+        find = args[0]
+        documents = await self[find["find"]].find(find.get("filter")).limit(find.get("limit", 0)).to_list()
+        returned = len(documents)
+        return {
+            "queryPlanner": {"winningPlan": {"stage": "LIMIT", "inputStage": {"stage": "COLLSCAN"}}},
+            "executionStats": {
+                "nReturned": returned,
+                "totalDocsExamined": len(self[find["find"]].documents),
+                "totalKeysExamined": 0,
+                "executionTimeMillis": 0,
+            },
+        }
+
+
+class FakeMongoClient:
+    # Clusters are shared by URL so every user connecting to the same URL sees the same data,
+    # the way the registry shares one pool between them
+    clusters = {}
+    latency = 0.0
+
+    def __init__(self, url, **kwargs):
+        self.databases = self.clusters.setdefault(url, {})
+
+    async def wait(self):
+        await asyncio.sleep(self.latency)
+
+    def __getitem__(self, name):
+        database = self.databases.get(name)
+        if database is None:
+            database = self.databases[name] = FakeDatabase(self, name)
+        return database
+
+    async def server_info(self):
+        await self.wait()
+        return {"version": "bench"}
+
+    @property
+    def admin(self):
+        return self["admin"]
+
+    async def list_database_names(self):
+        await self.wait()
+        return [name for name, database in self.databases.items() if database.collections]
+
+    async def drop_database(self, name):
+        await self.wait()
+        self.databases.pop(name, None)
+
+    def close(self):
+        pass
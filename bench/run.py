@@ -0,0 +1,297 @@
+# Offline load test: drives the real handlers in main.py through Pyrogram's own handler
+# filters with fake Telegram and Mongo stand-ins, so no bot token or cluster is needed.
+#
+#   python -m bench.run --users 200 --rounds 5
+#   python -m bench.run --trace-memory
+#   python -m bench.run --json results.json
+#   python -m bench.run --compare results.json --tolerance 0.2
+#
+# Run it from the repository root. The exit status is non-zero when a step fails or, with
+# --compare, when a step's p95 latency regresses beyond the tolerance.
+import argparse
+import asyncio
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+
+from bson.objectid import ObjectId
+from pyrogram.types import Message
+
+os.environ.setdefault("SESSION_BACKEND", "memory")
+
+import main  # noqa: E402
+from outbox import Outbox  # noqa: E402
+
+from bench.fakes import FakeCallbackQuery, FakeClient, FakeMessage, FakeMongoClient  # noqa: E402
+
+MONGO_URL = "mongodb://bench.invalid:27017"
+
+# Each step is (kind, label, payload): "command" and "text" send a message, "tap" presses the
+# button with that label on the keyboard the bot showed last in the user's chat.
+CONNECT = [
+    ("command", "/start", "/start"),
+    ("text", "connect", MONGO_URL),
+]
+OPEN_COLLECTION = [
+    ("tap", "Manage Databases", None),
+    ("tap", "List Databases", None),
+    ("tap", "bench", None),
+    ("tap", "items", None),
+]
+SCRIPTS = {
+    "browse": OPEN_COLLECTION + [
+        ("tap", "View Documents", None),
+        ("tap", "Next", None),
+        ("tap", "Next", None),
+        ("tap", "Previous", None),
+        ("tap", "Back to Collection Options", None),
+        ("tap", "Total Size", None),
+        ("tap", "Refresh", None),
+        ("tap", "Back to Collection Options", None),
+        ("tap", "Back to Collections", None),
+        ("tap", "Back to Databases", None),
+        ("tap", "Back to Database Management", None),
+    ],
+    "search": OPEN_COLLECTION + [
+        ("tap", "Analyze Schema", None),
+        ("tap", "Search Documents", None),
+        ("text", "search", '{"filter": {"age": {"$gte": 40}}, "sort": {"age": -1}, "limit": 10}'),
+        ("tap", "Explain", None),
+    ],
+    "insert": OPEN_COLLECTION + [
+        ("tap", "Insert Document", None),
+        ("text", "insert", '{"name": "bench", "age": 30, "file_size": 1024}'),
+    ],
+    "update": OPEN_COLLECTION + [
+        ("tap", "Update Document", None),
+        ("text", "update filter", '{"name": "bench"}'),
+        ("text", "update data", '{"$inc": {"age": 1}}'),
+    ],
+}
+SCRIPT_WEIGHTS = {"browse": 6, "search": 3, "insert": 1, "update": 1}
+
+
+def seed(documents):
+    database = FakeMongoClient(MONGO_URL)["bench"]
+    collection = database["items"]
+    rng = random.Random(0)
+    for i in range(documents):
+        collection.documents.append({
+            "_id": ObjectId(),
+            "name": f"user{i}",
+            "age": rng.randint(18, 90),
+            "file_size": rng.randint(1, 10 * 1024 * 1024),
+            "tags": [f"tag{rng.randint(0, 20)}" for _ in range(rng.randint(0, 5))],
+            "address": {"city": f"city{rng.randint(0, 50)}", "zip": f"{rng.randint(10000, 99999)}"},
+        })
+    database["events"].documents.extend({"_id": i, "kind": "view"} for i in range(100))
+
+
+class Router:
+    # Mirrors Pyrogram's dispatcher: the first handler whose filters accept the update runs
+    def __init__(self, client):
+        self.client = client
+        self.handlers = [handler for group in sorted(main.app.dispatcher.groups) for handler in main.app.dispatcher.groups[group]]
+        if not self.handlers:
+            raise RuntimeError("No handlers are registered on main.app")
+
+    async def dispatch(self, update):
+        for handler in self.handlers:
+            if isinstance(update, Message) != (type(handler).__name__ == "MessageHandler"):
+                continue
+            if await handler.check(self.client, update):
+                await handler.callback(self.client, update)
+                return True
+        return False
+
+
+def find_button(keyboards, label):
+    # Newest message first, the way a user finds the button nearest the bottom of the chat
+    for message_id, markup in reversed(keyboards.items()):
+        for row in markup.inline_keyboard:
+            for button in row:
+                if button.text == label:
+                    return message_id, button.callback_data
+    return None, None
+
+
+async def run_step(router, client, user_id, step):
+    kind, label, payload = step
+    if kind in ("command", "text"):
+        update = FakeMessage(client, user_id, user_id, payload)
+    else:
+        message_id, data = find_button(client.keyboards.get(user_id, {}), label)
+        if data is None:
+            raise LookupError(f"no '{label}' button; the bot last said {client.texts.get(user_id)!r:.200}")
+        update = FakeCallbackQuery(client, user_id, FakeMessage(client, user_id, user_id, None, message_id), data)
+    if not await router.dispatch(update):
+        raise LookupError(f"no handler accepted '{label}'")
+
+
+async def run_user(router, client, user_id, rounds, think_time, rng, stats):
+    # Every round is a fresh visit: /start, connect, then one weighted script
+    steps = []
+    for _ in range(rounds):
+        script = rng.choices(list(SCRIPT_WEIGHTS), weights=list(SCRIPT_WEIGHTS.values()))[0]
+        steps += [(step[1], step) for step in CONNECT]
+        steps += [(f"{script}: {step[1]}", step) for step in SCRIPTS[script]]
+    for name, step in steps:
+        if think_time:
+            await asyncio.sleep(rng.expovariate(1 / think_time))
+        start = time.perf_counter()
+        try:
+            await run_step(router, client, user_id, step)
+        except Exception as e:
+            stats["errors"].append(f"user {user_id} at {name}: {type(e).__name__}: {e}")
+            return
+        finally:
+            stats["latencies"].setdefault(name, []).append(time.perf_counter() - start)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+
+def summarize(latencies):
+    return {
+        "count": len(latencies),
+        "p50": percentile(latencies, 0.50),
+        "p95": percentile(latencies, 0.95),
+        "p99": percentile(latencies, 0.99),
+        "max": max(latencies),
+    }
+
+
+async def benchmark(args):
+    FakeMongoClient.clusters.clear()
+    FakeMongoClient.latency = args.mongo_latency
+    seed(args.documents)
+    main.client_registry.client_factory = FakeMongoClient
+    if not args.telegram_limits:
+        main.outbox = Outbox(global_rate=1e9, global_burst=1e9, chat_rate=1e9, chat_burst=1e9)
+    # Pyrogram registers decorated handlers with tasks scheduled on this loop
+    await asyncio.sleep(0)
+    client = FakeClient(latency=args.telegram_latency)
+    router = Router(client)
+    stats = {"latencies": {}, "errors": []}
+
+    # tracemalloc gives exact Python-level growth but slows every allocation several times over,
+    # so by default only the peak resident set size is compared
+    if args.trace_memory:
+        tracemalloc.start()
+    traced_before = tracemalloc.get_traced_memory()[0]
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    start = time.perf_counter()
+    await asyncio.gather(*[
+        run_user(router, client, 1000 + i, args.rounds, args.think_time, random.Random(args.seed + i), stats)
+        for i in range(args.users)
+    ])
+    elapsed = time.perf_counter() - start
+    traced_after, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_after = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    everything = [value for values in stats["latencies"].values() for value in values]
+    return {
+        "users": args.users,
+        "rounds": args.rounds,
+        "elapsed": elapsed,
+        "steps": {name: summarize(values) for name, values in sorted(stats["latencies"].items())},
+        "overall": summarize(everything) if everything else None,
+        "telegram_calls": dict(client.calls),
+        "callback_answers": dict(client.answers),
+        "messages_per_second": client.sent() / elapsed,
+        "max_rss_growth_kb": rss_after - rss_before,
+        "max_rss_kb": rss_after,
+        "traced_growth": traced_after - traced_before if args.trace_memory else None,
+        "traced_peak": traced_peak - traced_before if args.trace_memory else None,
+        "sessions": len(main.user_sessions),
+        "errors": stats["errors"],
+    }
+
+
+def print_report(result):
+    print(f"{result['users']} users x {result['rounds']} rounds in {result['elapsed']:.2f}s")
+    print(f"{'step':<45} {'n':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+    rows = list(result["steps"].items())
+    if result["overall"]:
+        rows.append(("overall", result["overall"]))
+    for name, summary in rows:
+        print(
+            f"{name[:45]:<45} {summary['count']:>6} {summary['p50'] * 1000:>9.2f} {summary['p95'] * 1000:>9.2f} "
+            f"{summary['p99'] * 1000:>9.2f} {summary['max'] * 1000:>9.2f}"
+        )
+    calls = ", ".join(f"{method} {count}" for method, count in sorted(result["telegram_calls"].items()))
+    print(f"Telegram calls: {calls}")
+    print(f"Messages per second: {result['messages_per_second']:.1f}")
+    for text, count in sorted(result["callback_answers"].items(), key=lambda item: -item[1])[:5]:
+        print(f"Answered {count} tap(s) with: {text[:80]}")
+    print(
+        f"Max RSS: {result['max_rss_kb'] / 1024:.1f} MiB (grew {result['max_rss_growth_kb'] / 1024:.1f} MiB), "
+        f"{result['sessions']} sessions held"
+    )
+    if result["traced_growth"] is not None:
+        print(
+            f"Traced memory growth: {result['traced_growth'] / 1024:.1f} KiB "
+            f"(peak {result['traced_peak'] / 1024:.1f} KiB)"
+        )
+    if result["errors"]:
+        print(f"{len(result['errors'])} failed script(s):")
+        for error in result["errors"][:10]:
+            print(f"  {error}")
+
+
+def compare(result, baseline, tolerance):
+    regressions = []
+    for name, summary in result["steps"].items():
+        before = baseline["steps"].get(name)
+        if before is None:
+            continue
+        if summary["p95"] > before["p95"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {before['p95'] * 1000:.2f} ms -> {summary['p95'] * 1000:.2f} ms")
+    return regressions
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Load-test the bot's handlers offline.")
+    parser.add_argument("--users", type=int, default=100, help="concurrent simulated users")
+    parser.add_argument("--rounds", type=int, default=3, help="scripts each user runs after connecting")
+    parser.add_argument("--documents", type=int, default=2000, help="documents seeded into bench.items")
+    parser.add_argument("--think-time", type=float, default=0.05, help="mean pause between a user's taps, seconds")
+    parser.add_argument("--mongo-latency", type=float, default=0.002, help="simulated round trip per Mongo call, seconds")
+    parser.add_argument("--telegram-latency", type=float, default=0.0, help="simulated round trip per Telegram call, seconds")
+    parser.add_argument("--telegram-limits", action="store_true", help="keep the outbox's real Telegram rate limits")
+    parser.add_argument("--trace-memory", action="store_true", help="measure Python allocations with tracemalloc (slow)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write the results to this file")
+    parser.add_argument("--compare", help="baseline results file to check p95 latencies against")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed p95 slowdown for --compare")
+    return parser.parse_args(argv)
+
+
+def run(argv=None):
+    args = parse_args(argv)
+    loop = asyncio.get_event_loop()
+    result = loop.run_until_complete(benchmark(args))
+    print_report(result)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(result, f, indent=2)
+    status = 1 if result["errors"] else 0
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            status = 1
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(run())
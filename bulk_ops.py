@@ -0,0 +1,74 @@
+import os
+import time
+
+from pymongo import DeleteMany, UpdateMany
+from pymongo.errors import ExecutionTimeout
+
+from pager import keyset_filter
+
+BULK_BATCH_SIZE = int(os.environ.get("BULK_BATCH_SIZE", 1000))
+BULK_COUNT_MAX_TIME_MS = int(os.environ.get("BULK_COUNT_MAX_TIME_MS", 10000))
+BULK_PROGRESS_INTERVAL = float(os.environ.get("BULK_PROGRESS_INTERVAL", 3))
+
+
+class BulkCancelled(Exception):
+    pass
+
+
+def normalize_update(update):
+    # Pipelines and operator documents go through untouched; a plain document means $set
+    if isinstance(update, list):
+        return update
+    if not isinstance(update, dict) or not update:
+        raise ValueError("The update must be a JSON object or an aggregation pipeline array.")
+    operators = [key.startswith("$") for key in update]
+    if all(operators):
+        return update
+    if any(operators):
+        raise ValueError("Don't mix update operators such as $set with plain fields.")
+    return {"$set": update}
+
+
+async def count_matches(collection, query, max_time_ms=BULK_COUNT_MAX_TIME_MS):
+    # Returns None when the count can't finish within the time limit
+    try:
+        return await collection.count_documents(query, maxTimeMS=max_time_ms)
+    except ExecutionTimeout:
+        return None
+
+
+async def run_in_batches(collection, query, update=None, batch_size=BULK_BATCH_SIZE, progress=None, cancelled=None):
+    # Walks the matching _ids in ascending order and applies the update (or a delete when
+    # update is None) one batch of _ids at a time, so no single server operation runs long.
+    # The original filter is re-applied to each batch, so documents that stopped matching
+    # after the _ids were read are left alone.
+    result = {"batches": 0, "matched": 0, "modified": 0, "deleted": 0}
+    last_id = None
+    last_progress = time.monotonic()
+    while True:
+        if cancelled is not None and cancelled.is_set():
+            raise BulkCancelled(result)
+        scan = query if last_id is None else {"$and": [query, keyset_filter("_id", last_id, "$gt")]}
+        cursor = collection.find(scan, {"_id": 1}).sort("_id", 1).limit(batch_size)
+        ids = [document["_id"] for document in await cursor.to_list(length=batch_size)]
+        if not ids:
+            break
+        # $in rather than a $gte/$lte range, which would match nothing when a batch spans
+        # two _id types
+        in_range = {"$and": [query, {"_id": {"$in": ids}}]}
+        if update is None:
+            request = DeleteMany(in_range)
+        else:
+            request = UpdateMany(in_range, update)
+        written = await collection.bulk_write([request], ordered=False)
+        result["batches"] += 1
+        result["matched"] += written.matched_count
+        result["modified"] += written.modified_count
+        result["deleted"] += written.deleted_count
+        last_id = ids[-1]
+        if progress is not None and time.monotonic() - last_progress >= BULK_PROGRESS_INTERVAL:
+            last_progress = time.monotonic()
+            await progress(result)
+        if len(ids) < batch_size:
+            break
+    return result
@@ -0,0 +1,94 @@
+import os
+import secrets
+from collections import OrderedDict
+
+CALLBACK_TOKENS_MAX = int(os.environ.get("CALLBACK_TOKENS_MAX", 100000))
+SEPARATOR = "|"
+EXPIRED_MESSAGE = "This button has expired. Please open the menu again."
+
+
+def typed_key(value):
+    # Equal is not the same here: True == 1 == 1.0 and 0 == False, but a button made for
+    # one must not hand its handler the other
+    if isinstance(value, tuple):
+        return (tuple, tuple(typed_key(item) for item in value))
+    return (type(value), value)
+
+
+class TokenTable:
+    # Maps short random tokens to callback arguments (namespaces, page anchors, ...), so
+    # callback_data stays a few bytes whatever the names are and never needs parsing.
+    # Equal arguments share a token, and the least recently used ones are dropped first.
+    def __init__(self, max_entries=CALLBACK_TOKENS_MAX):
+        self.max_entries = max_entries
+        self._payloads = OrderedDict()
+        self._tokens = {}
+
+    def intern(self, payload):
+        key = typed_key(payload)
+        try:
+            token = self._tokens.get(key)
+            hashable = True
+        except TypeError:
+            # Anchors can be documents or arrays; those just get a token of their own
+            token, hashable = None, False
+        if token is not None:
+            self._payloads.move_to_end(token)
+            return token
+        token = secrets.token_urlsafe(6)
+        while token in self._payloads:
+            token = secrets.token_urlsafe(6)
+        self._payloads[token] = payload
+        if hashable:
+            self._tokens[key] = token
+        while len(self._payloads) > self.max_entries:
+            old_token, old_payload = self._payloads.popitem(last=False)
+            old_key = typed_key(old_payload)
+            try:
+                if self._tokens.get(old_key) == old_token:
+                    del self._tokens[old_key]
+            except TypeError:
+                pass
+        return token
+
+    def lookup(self, token):
+        payload = self._payloads.get(token)
+        if payload is not None:
+            self._payloads.move_to_end(token)
+        return payload
+
+    def __len__(self):
+        return len(self._payloads)
+
+
+class CallbackRouter:
+    # callback_data is "action" or "action|token"; one dict lookup finds the handler, which
+    # is called with the interned arguments after (client, callback_query)
+    def __init__(self, tokens=None):
+        self.tokens = tokens if tokens is not None else TokenTable()
+        self._routes = {}
+
+    def route(self, action):
+        def register(handler):
+            self._routes[action] = handler
+            return handler
+        return register
+
+    def data(self, action, *args):
+        if not args:
+            return action
+        return f"{action}{SEPARATOR}{self.tokens.intern(args)}"
+
+    async def dispatch(self, client, callback_query):
+        action, _, token = (callback_query.data or "").partition(SEPARATOR)
+        handler = self._routes.get(action)
+        if handler is None:
+            await callback_query.answer()
+            return
+        args = ()
+        if token:
+            args = self.tokens.lookup(token)
+            if args is None:
+                await callback_query.answer(EXPIRED_MESSAGE, show_alert=True)
+                return
+        return await handler(client, callback_query, *args)
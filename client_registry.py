@@ -0,0 +1,141 @@
+import asyncio
+import hashlib
+import os
+import time
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_MAX_POOL_SIZE = int(os.environ.get("MONGO_MAX_POOL_SIZE", 20))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get("MONGO_MAX_IDLE_TIME_MS", 60000))
+CLIENT_IDLE_TIMEOUT = int(os.environ.get("CLIENT_IDLE_TIMEOUT", 600))
+CLIENT_EVICT_INTERVAL = int(os.environ.get("CLIENT_EVICT_INTERVAL", 60))
+
+
+def normalize_url(url):
+    # Equivalent URLs (host order, option order, case) must share one pool
+    parts = urlsplit(url.strip())
+    credentials, _, hosts = parts.netloc.rpartition("@")
+    hosts = ",".join(sorted(host.lower() for host in hosts.split(",")))
+    netloc = f"{credentials}@{hosts}" if credentials else hosts
+    query = urlencode(sorted((key.lower(), value) for key, value in parse_qsl(parts.query)))
+    path = parts.path if parts.path not in ("", "/") else "/"
+    return urlunsplit((parts.scheme.lower(), netloc, path, query, ""))
+
+
+def registry_key(url):
+    # Hashed so credentials never show up in stats, logs or cache keys
+    return hashlib.sha256(normalize_url(url).encode()).hexdigest()
+
+
+class ClientHandle:
+    __slots__ = ("_registry", "key", "client", "released")
+
+    def __init__(self, registry, key, client):
+        self._registry = registry
+        self.key = key
+        self.client = client
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self._registry.release(self.key)
+
+
+class _Entry:
+    __slots__ = ("client", "refs", "last_used", "created_at")
+
+    def __init__(self, client):
+        self.client = client
+        self.refs = 0
+        self.last_used = time.monotonic()
+        self.created_at = self.last_used
+
+
+class ClientRegistry:
+    def __init__(self, max_pool_size=MONGO_MAX_POOL_SIZE, idle_timeout=CLIENT_IDLE_TIMEOUT,
+                 evict_interval=CLIENT_EVICT_INTERVAL, client_factory=AsyncIOMotorClient, event_listeners=()):
+        self.max_pool_size = max_pool_size
+        self.idle_timeout = idle_timeout
+        self.evict_interval = evict_interval
+        self.client_factory = client_factory
+        self.event_listeners = list(event_listeners)
+        self._entries = {}
+        self._locks = {}
+        self._evict_task = None
+
+    async def acquire(self, url):
+        key = registry_key(url)
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                client = self.client_factory(
+                    url,
+                    maxPoolSize=self.max_pool_size,
+                    minPoolSize=0,
+                    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+                    event_listeners=self.event_listeners,
+                )
+                try:
+                    await client.server_info()  # Test the connection
+                except Exception:
+                    client.close()
+                    raise
+                entry = self._entries[key] = _Entry(client)
+            entry.refs += 1
+            entry.last_used = time.monotonic()
+        return ClientHandle(self, key, entry.client)
+
+    def release(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.refs = max(0, entry.refs - 1)
+            entry.last_used = time.monotonic()
+
+    def evict_idle(self):
+        now = time.monotonic()
+        evicted = 0
+        for key, entry in list(self._entries.items()):
+            if entry.refs == 0 and now - entry.last_used >= self.idle_timeout:
+                del self._entries[key]
+                self._locks.pop(key, None)
+                entry.client.close()
+                evicted += 1
+        # Locks left behind by URLs that never connected
+        for key in list(self._locks):
+            if key not in self._entries and not self._locks[key].locked():
+                del self._locks[key]
+        return evicted
+
+    async def _evict_loop(self):
+        while True:
+            await asyncio.sleep(self.evict_interval)
+            self.evict_idle()
+
+    def start(self):
+        if self._evict_task is None:
+            self._evict_task = asyncio.ensure_future(self._evict_loop())
+
+    def close_all(self):
+        if self._evict_task is not None:
+            self._evict_task.cancel()
+            self._evict_task = None
+        for entry in self._entries.values():
+            entry.client.close()
+        self._entries.clear()
+        self._locks.clear()
+
+    def stats(self):
+        now = time.monotonic()
+        return [
+            {
+                "key": key[:8],
+                "refs": entry.refs,
+                "idle": now - entry.last_used,
+                "age": now - entry.created_at,
+                "max_pool_size": self.max_pool_size,
+            }
+            for key, entry in self._entries.items()
+        ]
@@ -0,0 +1,172 @@
+import asyncio
+import contextlib
+import functools
+import os
+import time
+from collections import OrderedDict
+
+from pyrogram.types import CallbackQuery
+
+from metrics import BUSY_REJECTIONS, DUPLICATE_TAPS
+
+USER_MAX_PENDING = int(os.environ.get("USER_MAX_PENDING", 5))
+USER_QUEUE_MAX_USERS = int(os.environ.get("USER_QUEUE_MAX_USERS", 10000))
+TAP_DEBOUNCE = float(os.environ.get("TAP_DEBOUNCE", 1))
+BUSY_WAIT = float(os.environ.get("BUSY_WAIT", 2))
+QUERY_CONCURRENCY = int(os.environ.get("QUERY_CONCURRENCY", 32))
+QUERY_CLUSTER_CONCURRENCY = int(os.environ.get("QUERY_CLUSTER_CONCURRENCY", 8))
+JOB_CONCURRENCY = int(os.environ.get("JOB_CONCURRENCY", 8))
+JOB_CLUSTER_CONCURRENCY = int(os.environ.get("JOB_CLUSTER_CONCURRENCY", 2))
+# Each open change stream keeps a pooled connection busy in getMore
+TAIL_CONCURRENCY = int(os.environ.get("TAIL_CONCURRENCY", 100))
+TAIL_CLUSTER_CONCURRENCY = int(os.environ.get("TAIL_CLUSTER_CONCURRENCY", 10))
+
+BUSY_MESSAGE = "The bot is busy right now. Please try again in a moment."
+
+
+class Busy(Exception):
+    pass
+
+
+async def reply_busy(update):
+    if isinstance(update, CallbackQuery):
+        await update.answer(BUSY_MESSAGE, show_alert=True)
+    else:
+        await update.reply_text(BUSY_MESSAGE)
+
+
+class _UserState:
+    __slots__ = ("lock", "pending", "taps", "last_tap", "last_tap_at")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        self.taps = set()
+        self.last_tap = None
+        self.last_tap_at = 0.0
+
+
+class UserQueue:
+    # Runs each user's updates one at a time in arrival order (asyncio.Lock wakes waiters
+    # FIFO), while different users still run concurrently
+    def __init__(self, max_pending=USER_MAX_PENDING, debounce=TAP_DEBOUNCE, max_users=USER_QUEUE_MAX_USERS):
+        self.max_pending = max_pending
+        self.debounce = debounce
+        self.max_users = max_users
+        self._users = OrderedDict()
+
+    def _state(self, user_id):
+        state = self._users.get(user_id)
+        if state is None:
+            state = self._users[user_id] = _UserState()
+            if len(self._users) > self.max_users:
+                for other_id, other in list(self._users.items()):
+                    if len(self._users) <= self.max_users:
+                        break
+                    if other_id != user_id and other.pending == 0:
+                        del self._users[other_id]
+        else:
+            self._users.move_to_end(user_id)
+        return state
+
+    def _duplicate(self, state, data):
+        # The same button on the same message tapped again while the first tap is queued,
+        # running, or just finished
+        if data in state.taps:
+            return True
+        return data == state.last_tap and time.monotonic() - state.last_tap_at < self.debounce
+
+    def serialized(self, handler):
+        @functools.wraps(handler)
+        async def wrapper(client, update):
+            state = self._state(update.from_user.id)
+            data = None
+            if isinstance(update, CallbackQuery):
+                data = (update.message.id if update.message is not None else None, update.data)
+            if data is not None and self._duplicate(state, data):
+                DUPLICATE_TAPS.inc()
+                await update.answer()
+                return
+            if state.pending >= self.max_pending:
+                BUSY_REJECTIONS.inc(kind="user_queue")
+                await reply_busy(update)
+                return
+            state.pending += 1
+            if data is not None:
+                state.taps.add(data)
+            try:
+                async with state.lock:
+                    return await handler(client, update)
+            except Busy:
+                await reply_busy(update)
+            finally:
+                state.pending -= 1
+                if data is not None:
+                    state.taps.discard(data)
+                    state.last_tap = data
+                    state.last_tap_at = time.monotonic()
+        return wrapper
+
+
+class Backpressure:
+    # Bounds how many expensive operations run at once, overall and per cluster. Callers
+    # wait at most `wait` seconds for a slot and then get Busy instead of piling up.
+    def __init__(self, limit, cluster_limit, wait=BUSY_WAIT, name="query"):
+        self.limit = limit
+        self.cluster_limit = cluster_limit
+        self.wait = wait
+        self.name = name
+        self.active = 0
+        self._global = None
+        self._clusters = {}
+
+    async def _acquire(self, semaphore):
+        if not semaphore.locked():
+            await semaphore.acquire()
+            return
+        try:
+            await asyncio.wait_for(semaphore.acquire(), self.wait)
+        except asyncio.TimeoutError:
+            BUSY_REJECTIONS.inc(kind=self.name)
+            raise Busy() from None
+
+    async def acquire(self, cluster_key):
+        if self._global is None:
+            self._global = asyncio.Semaphore(self.limit)
+        entry = self._clusters.get(cluster_key)
+        if entry is None:
+            entry = self._clusters[cluster_key] = [asyncio.Semaphore(self.cluster_limit), 0]
+        entry[1] += 1
+        try:
+            # The cluster slot comes first so one overloaded cluster can't sit on global slots
+            await self._acquire(entry[0])
+            try:
+                await self._acquire(self._global)
+            except BaseException:
+                entry[0].release()
+                raise
+        except BaseException:
+            self._forget(cluster_key, entry)
+            raise
+        self.active += 1
+
+    def release(self, cluster_key):
+        entry = self._clusters[cluster_key]
+        self.active -= 1
+        self._global.release()
+        entry[0].release()
+        self._forget(cluster_key, entry)
+
+    def _forget(self, cluster_key, entry):
+        entry[1] -= 1
+        if entry[1] == 0:
+            del self._clusters[cluster_key]
+
+    @contextlib.asynccontextmanager
+    async def slot(self, cluster_key):
+        await self.acquire(cluster_key)
+        try:
+            yield
+        finally:
+            self.release(cluster_key)
+
@@ -0,0 +1,160 @@
+import asyncio
+import csv
+import datetime
+import gzip
+import io
+import os
+import shutil
+import tempfile
+import time
+
+from bson.json_util import RELAXED_JSON_OPTIONS, dumps
+from bson.objectid import ObjectId
+
+EXPORT_BATCH_SIZE = int(os.environ.get("EXPORT_BATCH_SIZE", 1000))
+EXPORT_MAX_ROWS = int(os.environ.get("EXPORT_MAX_ROWS", 1000000))
+# Telegram bots can upload at most 50 MB
+EXPORT_MAX_BYTES = int(os.environ.get("EXPORT_MAX_BYTES", 45 * 1024 * 1024))
+EXPORT_PROGRESS_INTERVAL = float(os.environ.get("EXPORT_PROGRESS_INTERVAL", 3))
+
+FORMATS = ("jsonl", "csv")
+
+
+class ExportCancelled(Exception):
+    pass
+
+
+def csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, (str, int, float, bool)):
+        return value
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime.datetime):
+        return value.isoformat()
+    return dumps(value, json_options=RELAXED_JSON_OPTIONS)
+
+
+class _Writer:
+    # Owns the compressed temp file; every method here runs in the executor. CSV rows go to
+    # a side file while the columns are still growing, and the header (a gzip member of
+    # its own) is put in front of them on close, so fields first seen late still get a column.
+    def __init__(self, path, fmt, compress):
+        self.fmt = fmt
+        self.path = path
+        self.compress = compress
+        self.columns = []
+        self._body_path = path + ".rows" if fmt == "csv" else path
+        self._raw = open(self._body_path, "wb")
+        stream = gzip.GzipFile(fileobj=self._raw, mode="wb") if compress else self._raw
+        self._gzip = stream if compress else None
+        self._text = io.TextIOWrapper(stream, encoding="utf-8", newline="")
+        self._csv = csv.writer(self._text) if fmt == "csv" else None
+
+    def write_batch(self, documents, projection=None):
+        if self.fmt == "jsonl":
+            self._text.write("".join(dumps(doc, json_options=RELAXED_JSON_OPTIONS) + "\n" for doc in documents))
+        else:
+            known = set(self.columns)
+            self.columns += [column for column in csv_columns(documents, projection) if column not in known]
+            self._csv.writerows([csv_value(lookup(doc, column)) for column in self.columns] for doc in documents)
+        self._text.flush()
+        return self._raw.tell()
+
+    def close(self):
+        self._text.close()
+        if self._gzip is not None:
+            self._raw.close()
+        if self.fmt == "csv":
+            header = io.StringIO()
+            csv.writer(header).writerow(self.columns)
+            data = header.getvalue().encode("utf-8")
+            with open(self.path, "wb") as f:
+                f.write(gzip.compress(data) if self.compress else data)
+                with open(self._body_path, "rb") as body:
+                    shutil.copyfileobj(body, f)
+            os.remove(self._body_path)
+        return os.path.getsize(self.path)
+
+    def discard(self):
+        self._text.close()
+        if self._gzip is not None:
+            self._raw.close()
+        for path in {self.path, self._body_path}:
+            if os.path.exists(path):
+                os.remove(path)
+
+
+def lookup(document, path):
+    value = document
+    for part in path.split("."):
+        if not isinstance(value, dict):
+            return None
+        value = value.get(part)
+    return value
+
+
+def csv_columns(documents, projection=None):
+    # An inclusion projection names the columns; otherwise they come from the documents,
+    # less whatever an exclusion projection dropped
+    if projection and any(projection.values()):
+        columns = [field for field, include in projection.items() if include]
+        if "_id" not in projection:
+            columns.insert(0, "_id")
+        return columns
+    excluded = {field for field, include in (projection or {}).items() if not include}
+    columns = {}
+    for doc in documents:
+        for field in doc:
+            if field not in excluded:
+                columns.setdefault(field, None)
+    return list(columns)
+
+
+async def export_collection(collection, fmt="jsonl", query=None, projection=None, compress=True,
+                            batch_size=EXPORT_BATCH_SIZE, max_rows=EXPORT_MAX_ROWS, max_bytes=EXPORT_MAX_BYTES,
+                            progress=None, cancelled=None):
+    # Streams the cursor into a temp file one batch at a time, so memory stays bounded by
+    # batch_size whatever the collection size. Returns a dict describing the file; the caller
+    # owns (and must remove) result["path"].
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown export format: {fmt}")
+    suffix = f".{fmt}.gz" if compress else f".{fmt}"
+    fd, path = tempfile.mkstemp(prefix="export-", suffix=suffix)
+    os.close(fd)
+    loop = asyncio.get_event_loop()
+    writer = _Writer(path, fmt, compress)
+    result = {"path": path, "rows": 0, "bytes": 0, "limit": None}
+    last_progress = time.monotonic()
+    cursor = collection.find(query or {}, projection, batch_size=batch_size)
+    try:
+        batch = []
+        async for document in cursor:
+            batch.append(document)
+            if len(batch) < batch_size and result["rows"] + len(batch) < max_rows:
+                continue
+            if cancelled is not None and cancelled.is_set():
+                raise ExportCancelled
+            result["bytes"] = await loop.run_in_executor(None, writer.write_batch, batch, projection)
+            result["rows"] += len(batch)
+            batch = []
+            if result["rows"] >= max_rows:
+                result["limit"] = "rows"
+                break
+            if result["bytes"] >= max_bytes:
+                result["limit"] = "bytes"
+                break
+            if progress is not None and time.monotonic() - last_progress >= EXPORT_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await progress(result["rows"], result["bytes"])
+        if batch:
+            await loop.run_in_executor(None, writer.write_batch, batch, projection)
+            result["rows"] += len(batch)
+    except BaseException:
+        await cursor.close()
+        await loop.run_in_executor(None, writer.discard)
+        raise
+    await cursor.close()
+    result["bytes"] = await loop.run_in_executor(None, writer.close)
+    return result
@@ -0,0 +1,243 @@
+import asyncio
+import gzip
+import json
+import os
+import time
+
+import bson
+from bson import json_util
+from bson.errors import InvalidDocument
+from pymongo.errors import BulkWriteError
+
+IMPORT_BATCH_SIZE = int(os.environ.get("IMPORT_BATCH_SIZE", 1000))
+IMPORT_MAX_IN_FLIGHT = int(os.environ.get("IMPORT_MAX_IN_FLIGHT", 4))
+IMPORT_READ_SIZE = 64 * 1024
+IMPORT_PROGRESS_INTERVAL = float(os.environ.get("IMPORT_PROGRESS_INTERVAL", 3))
+# Nothing larger than a BSON document can be inserted anyway
+MAX_RECORD_SIZE = 16 * 1024 * 1024
+# A parse error this close to the end of the buffer may just be a record cut off mid-token
+TRUNCATION_MARGIN = 16
+
+ERROR_LABELS = {
+    11000: "duplicate key",
+    121: "document failed validation",
+}
+
+
+class JsonStreamReader:
+    # Reads a JSON array, JSONL, or plain concatenated JSON documents without loading
+    # the whole file. Extended JSON ($oid, $date, ...) is decoded into BSON types.
+    def __init__(self, path, compressed=False):
+        if compressed:
+            self._file = gzip.open(path, "rt", encoding="utf-8")
+        else:
+            self._file = open(path, encoding="utf-8")
+        self._decoder = json.JSONDecoder(object_hook=json_util.object_hook)
+        self._buffer = ""
+        self._pos = 0
+        self._eof = False
+        self._array = None
+        self.records = 0
+        self.done = False
+
+    def _fill(self):
+        chunk = self._file.read(IMPORT_READ_SIZE)
+        if not chunk:
+            self._eof = True
+        self._buffer = self._buffer[self._pos:] + chunk
+        self._pos = 0
+
+    def _skip_separators(self):
+        while True:
+            while self._pos < len(self._buffer) and self._buffer[self._pos] in " \t\r\n,":
+                self._pos += 1
+            if self._pos < len(self._buffer) or self._eof:
+                return
+            self._fill()
+
+    def _truncated(self, error):
+        # Decoding stops at the end of the input when a record is cut off; a string cut off
+        # is reported where it starts. Anything else is a bad record, and refilling (which
+        # copies the buffer) won't fix it.
+        if self._eof or len(self._buffer) - self._pos >= MAX_RECORD_SIZE:
+            return False
+        return error.pos >= len(self._buffer) - TRUNCATION_MARGIN or error.msg.startswith("Unterminated string")
+
+    def _skip_element(self):
+        # Skips the rest of a bad array element, up to the next comma or closing bracket
+        # outside strings and nested values, so a minified one-line array keeps its other elements
+        depth = 0
+        in_string = escaped = False
+        while True:
+            while self._pos < len(self._buffer):
+                char = self._buffer[self._pos]
+                if in_string:
+                    if escaped:
+                        escaped = False
+                    elif char == "\\":
+                        escaped = True
+                    elif char == '"':
+                        in_string = False
+                elif char == '"':
+                    in_string = True
+                elif char in "[{":
+                    depth += 1
+                elif char in "]}":
+                    if depth == 0:
+                        return
+                    depth -= 1
+                elif char == "," and depth == 0:
+                    return
+                self._pos += 1
+            if self._eof:
+                return
+            self._fill()
+
+    def _skip_line(self):
+        while True:
+            newline = self._buffer.find("\n", self._pos)
+            if newline != -1:
+                self._pos = newline + 1
+                return
+            self._pos = len(self._buffer)
+            if self._eof:
+                return
+            self._fill()
+
+    def read_batch(self, size):
+        # Returns (documents, errors); errors are (record number, message) pairs
+        documents = []
+        errors = []
+        while len(documents) < size:
+            self._skip_separators()
+            if self._pos >= len(self._buffer):
+                self.done = True
+                break
+            char = self._buffer[self._pos]
+            if self._array is None:
+                self._array = char == "["
+                if self._array:
+                    self._pos += 1
+                    continue
+            if self._array and char == "]":
+                self._pos += 1
+                continue
+            try:
+                value, end = self._decoder.raw_decode(self._buffer, self._pos)
+            except json.JSONDecodeError as e:
+                if self._truncated(e):
+                    self._fill()
+                    continue
+                self.records += 1
+                errors.append((self.records, e.msg))
+                if self._array:
+                    self._skip_element()
+                else:
+                    self._skip_line()
+                continue
+            self._pos = end
+            self.records += 1
+            if isinstance(value, dict):
+                documents.append(value)
+            else:
+                errors.append((self.records, "not a JSON object"))
+        return documents, errors
+
+    def close(self):
+        self._file.close()
+
+
+def record_error(summary, label, message, count=1):
+    entry = summary["errors"].setdefault(label, {"count": 0, "example": message})
+    entry["count"] += count
+    summary["failed"] += count
+
+
+def encodable(documents, summary):
+    # Drops the documents BSON can't hold (integers over 8 bytes, oversized documents, ...)
+    valid = []
+    for document in documents:
+        try:
+            if len(bson.encode(document)) > MAX_RECORD_SIZE:
+                raise InvalidDocument("document is larger than the 16 MB BSON limit")
+        except (InvalidDocument, OverflowError) as e:
+            record_error(summary, "invalid document", str(e))
+            continue
+        valid.append(document)
+    return valid
+
+
+async def insert_batch(collection, documents, summary):
+    try:
+        result = await collection.insert_many(documents, ordered=False)
+        summary["inserted"] += len(result.inserted_ids)
+    except BulkWriteError as e:
+        # Unordered inserts keep going past bad rows; tally what the server rejected
+        summary["inserted"] += e.details.get("nInserted", 0)
+        for error in e.details.get("writeErrors", []):
+            label = ERROR_LABELS.get(error.get("code"), f"error {error.get('code')}")
+            record_error(summary, label, error.get("errmsg", ""))
+    except (InvalidDocument, OverflowError):
+        # Encoding fails before anything is sent, so the rest of the batch can be retried
+        valid = encodable(documents, summary)
+        if len(valid) < len(documents):
+            if valid:
+                await insert_batch(collection, valid, summary)
+        else:
+            record_error(summary, "invalid document", "the batch could not be encoded", len(documents))
+    except Exception as e:
+        record_error(summary, type(e).__name__, str(e), len(documents))
+
+
+async def import_file(collection, path, compressed=False, batch_size=IMPORT_BATCH_SIZE,
+                      max_in_flight=IMPORT_MAX_IN_FLIGHT, progress=None, cancelled=None):
+    loop = asyncio.get_event_loop()
+    summary = {"read": 0, "inserted": 0, "failed": 0, "errors": {}, "cancelled": False}
+    reader = await loop.run_in_executor(None, JsonStreamReader, path, compressed)
+    in_flight = asyncio.Semaphore(max_in_flight)
+    pending = set()
+    last_progress = time.monotonic()
+
+    def finished(task):
+        in_flight.release()
+
+    def collect():
+        # Finished batches stay in pending until their result is read, so nothing raised
+        # inside one goes unnoticed
+        for task in [task for task in pending if task.done()]:
+            pending.discard(task)
+            task.result()
+
+    try:
+        while not reader.done:
+            if cancelled is not None and cancelled.is_set():
+                summary["cancelled"] = True
+                break
+            documents, errors = await loop.run_in_executor(None, reader.read_batch, batch_size)
+            for record, message in errors:
+                record_error(summary, "invalid JSON", f"record {record}: {message}")
+            if not documents:
+                continue
+            summary["read"] += len(documents)
+            # Parsing runs ahead of the server by at most max_in_flight batches
+            await in_flight.acquire()
+            task = asyncio.ensure_future(insert_batch(collection, documents, summary))
+            pending.add(task)
+            task.add_done_callback(finished)
+            collect()
+            if progress is not None and time.monotonic() - last_progress >= IMPORT_PROGRESS_INTERVAL:
+                last_progress = time.monotonic()
+                await progress(summary)
+        if pending:
+            await asyncio.wait(pending)
+            collect()
+    finally:
+        reader.close()
+    return summary
+
+
+def format_summary(summary):
+    lines = [f"Read {summary['read']} documents, inserted {summary['inserted']}, failed {summary['failed']}."]
+    for label, entry in summary["errors"].items():
+        lines.append(f"- {label}: {entry['count']} (e.g. {entry['example'][:200]})")
+    return "\n".join(lines)
@@ -0,0 +1,184 @@
+import asyncio
+import os
+from collections import Counter, OrderedDict, deque
+
+from pymongo.errors import OperationFailure
+
+from size_engine import storage_stats
+
+INDEX_PROGRESS_INTERVAL = float(os.environ.get("INDEX_PROGRESS_INTERVAL", 5))
+ADVISOR_HISTORY = int(os.environ.get("ADVISOR_HISTORY", 200))
+ADVISOR_MAX_NAMESPACES = int(os.environ.get("ADVISOR_MAX_NAMESPACES", 1000))
+
+INDEX_OPTIONS = {"name", "unique", "sparse", "expireAfterSeconds", "partialFilterExpression", "hidden", "collation"}
+INDEX_TYPES = {1, -1, "text", "2d", "2dsphere", "hashed"}
+EQUALITY_OPERATORS = {"$eq", "$in"}
+RANGE_OPERATORS = {"$gt", "$gte", "$lt", "$lte", "$ne", "$nin", "$regex", "$exists", "$type", "$elemMatch"}
+
+
+async def index_sizes(collection):
+    stats = await storage_stats(collection)
+    return stats["indexSizes"] if stats else {}
+
+
+async def index_usage(collection):
+    # $indexStats needs the indexStats privilege; usage is simply left out without it
+    usage = {}
+    try:
+        cursor = collection.aggregate([{"$indexStats": {}}])
+        for stats in await cursor.to_list(length=None):
+            entry = usage.setdefault(stats["name"], {"ops": 0, "since": None})
+            entry["ops"] += stats.get("accesses", {}).get("ops", 0)
+            since = stats.get("accesses", {}).get("since")
+            if since is not None and (entry["since"] is None or since < entry["since"]):
+                entry["since"] = since
+    except OperationFailure:
+        return None
+    return usage
+
+
+async def list_indexes(collection):
+    indexes, sizes, usage = await asyncio.gather(
+        collection.list_indexes().to_list(length=None),
+        index_sizes(collection),
+        index_usage(collection),
+    )
+    result = []
+    for index in indexes:
+        name = index["name"]
+        result.append({
+            "name": name,
+            "key": list(index["key"].items()),
+            "options": {option: index[option] for option in INDEX_OPTIONS if option in index and option != "name"},
+            "size": sizes.get(name),
+            "usage": usage.get(name) if usage is not None else None,
+        })
+    return result
+
+
+def parse_index_spec(spec):
+    # Either a bare key document, or {"keys": {...}, "unique": true, "expireAfterSeconds": 3600, ...}
+    if not isinstance(spec, dict) or not spec:
+        raise ValueError("The index must be a JSON object such as {\"email\": 1}.")
+    if "keys" in spec:
+        keys = spec["keys"]
+        options = {option: value for option, value in spec.items() if option != "keys"}
+        unknown = set(options) - INDEX_OPTIONS
+        if unknown:
+            raise ValueError(f"Unknown index options: {', '.join(sorted(unknown))}")
+    else:
+        keys, options = spec, {}
+    if not isinstance(keys, dict) or not keys:
+        raise ValueError("The index keys must be a non-empty JSON object.")
+    for field, kind in keys.items():
+        if kind not in INDEX_TYPES:
+            raise ValueError(f"Unsupported index type for {field}: {kind}")
+    return list(keys.items()), options
+
+
+async def build_progress(collection):
+    # Reports (done, total, message) for an index build on this namespace, when visible
+    namespace = f"{collection.database.name}.{collection.name}"
+    pipeline = [
+        {"$currentOp": {"allUsers": True, "idleConnections": False}},
+        {"$match": {"ns": namespace, "command.createIndexes": {"$exists": True}}},
+    ]
+    try:
+        cursor = collection.database.client.admin.aggregate(pipeline)
+        operations = await cursor.to_list(length=None)
+    except OperationFailure:
+        return None
+    for operation in operations:
+        progress = operation.get("progress")
+        if progress:
+            return progress.get("done"), progress.get("total"), operation.get("msg", "")
+    return None
+
+
+async def build_index(collection, keys, options, progress=None, interval=INDEX_PROGRESS_INTERVAL):
+    task = asyncio.ensure_future(collection.create_index(keys, **options))
+    while not task.done():
+        await asyncio.wait([task], timeout=interval)
+        if not task.done() and progress is not None:
+            await progress(await build_progress(collection))
+    return task.result()
+
+
+async def drop_index(collection, name):
+    await collection.drop_index(name)
+
+
+def query_shape(query, sort=None):
+    # Splits a filter into equality and range fields, looking through top-level $and
+    equality, ranges = set(), []
+    clauses = [query or {}]
+    while clauses:
+        clause = clauses.pop()
+        for field, value in clause.items():
+            if field == "$and" and isinstance(value, list):
+                clauses.extend(item for item in value if isinstance(item, dict))
+                continue
+            if field.startswith("$"):
+                # $or, $expr, $text and friends need index designs this advisor doesn't attempt
+                continue
+            if isinstance(value, dict) and value and all(key.startswith("$") for key in value):
+                if set(value) <= EQUALITY_OPERATORS:
+                    equality.add(field)
+                elif set(value) & RANGE_OPERATORS and field not in ranges:
+                    ranges.append(field)
+            else:
+                equality.add(field)
+    sort = [(field, direction) for field, direction in (sort or []) if field not in equality]
+    sorted_fields = {field for field, _ in sort}
+    ranges = [field for field in ranges if field not in equality and field not in sorted_fields]
+    return tuple(sorted(equality)), tuple(sort), tuple(ranges)
+
+
+def suggested_keys(shape):
+    # Equality fields first, then the sort, then range fields (the ESR rule)
+    equality, sort, ranges = shape
+    keys = [(field, 1) for field in equality] + list(sort) + [(field, 1) for field in ranges]
+    return keys
+
+
+def covers(index_key, shape):
+    fields = [field for field, _ in index_key]
+    equality, sort, ranges = shape
+    if set(fields[:len(equality)]) != set(equality):
+        return False
+    rest = [field for field, _ in sort] + list(ranges[:1])
+    return fields[len(equality):len(equality) + len(rest)] == rest
+
+
+class IndexAdvisor:
+    def __init__(self, history=ADVISOR_HISTORY, max_namespaces=ADVISOR_MAX_NAMESPACES):
+        self.history = history
+        self.max_namespaces = max_namespaces
+        self._shapes = OrderedDict()
+
+    def record(self, cluster_key, db_name, coll_name, query, sort=None):
+        shape = query_shape(query, sort)
+        if not any(shape):
+            return
+        key = (cluster_key, db_name, coll_name)
+        shapes = self._shapes.get(key)
+        if shapes is None:
+            shapes = self._shapes[key] = deque(maxlen=self.history)
+            while len(self._shapes) > self.max_namespaces:
+                self._shapes.popitem(last=False)
+        else:
+            self._shapes.move_to_end(key)
+        shapes.append(shape)
+
+    def suggest(self, cluster_key, db_name, coll_name, existing_keys, limit=5):
+        shapes = self._shapes.get((cluster_key, db_name, coll_name), ())
+        suggestions = []
+        for shape, count in Counter(shapes).most_common():
+            if any(covers(key, shape) for key in existing_keys):
+                continue
+            keys = suggested_keys(shape)
+            if keys not in [suggestion["keys"] for suggestion in suggestions]:
+                suggestions.append({"keys": keys, "queries": count})
+            if len(suggestions) >= limit:
+                break
+        return suggestions
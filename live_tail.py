@@ -0,0 +1,128 @@
+import asyncio
+import os
+import time
+from collections import Counter, deque
+
+from pymongo.errors import ConnectionFailure
+
+TAIL_BATCH_WINDOW = float(os.environ.get("TAIL_BATCH_WINDOW", 3))
+TAIL_IDLE_TIMEOUT = int(os.environ.get("TAIL_IDLE_TIMEOUT", 600))
+TAIL_MAX_DURATION = int(os.environ.get("TAIL_MAX_DURATION", 3600))
+TAIL_POLL_MS = int(os.environ.get("TAIL_POLL_MS", 1000))
+TAIL_MAX_SHOWN = int(os.environ.get("TAIL_MAX_SHOWN", 10))
+TAIL_MAX_RETRIES = int(os.environ.get("TAIL_MAX_RETRIES", 5))
+
+TAIL_OPTIONS = {"filter", "projection"}
+# Change event fields kept alongside a projected fullDocument
+EVENT_FIELDS = ("operationType", "documentKey", "updateDescription")
+
+
+def parse_tail_spec(spec):
+    # Either a bare filter, or {"filter": ..., "projection": ...}
+    if isinstance(spec, dict) and spec and set(spec) <= TAIL_OPTIONS:
+        tail = {"filter": spec.get("filter", {}), "projection": spec.get("projection")}
+    else:
+        tail = {"filter": spec, "projection": None}
+    if not isinstance(tail["filter"], dict):
+        raise ValueError("The filter must be a JSON object.")
+    if tail["projection"] is not None and not isinstance(tail["projection"], dict):
+        raise ValueError("The projection must be a JSON object.")
+    tail["pipeline"] = change_pipeline(tail)
+    return tail
+
+
+def prefix_filter(query, prefix):
+    # Rewrites a collection filter so it applies to the changed document inside an event
+    result = {}
+    for field, value in query.items():
+        if field in ("$and", "$or", "$nor") and isinstance(value, list):
+            result[field] = [prefix_filter(clause, prefix) for clause in value]
+        elif field.startswith("$"):
+            raise ValueError(f"{field} can't be used in a live tail filter.")
+        else:
+            result[f"{prefix}.{field}"] = value
+    return result
+
+
+def change_pipeline(tail):
+    pipeline = []
+    if tail["filter"]:
+        pipeline.append({"$match": prefix_filter(tail["filter"], "fullDocument")})
+    projection = tail["projection"]
+    if projection:
+        stage = {f"fullDocument.{field}": value for field, value in projection.items()}
+        if any(projection.values()):
+            # An inclusion projection would otherwise drop the rest of the event
+            stage.update(dict.fromkeys(EVENT_FIELDS, 1))
+        pipeline.append({"$project": stage})
+    return pipeline
+
+
+def event_view(change):
+    view = {"op": change["operationType"], "_id": change.get("documentKey", {}).get("_id")}
+    description = change.get("updateDescription")
+    if description:
+        view["changed"] = sorted(description.get("updatedFields", {}))
+        if description.get("removedFields"):
+            view["removed"] = description["removedFields"]
+    if change.get("fullDocument") is not None:
+        view["document"] = change["fullDocument"]
+    return view
+
+
+async def tail_collection(collection, tail, on_batch, cancelled, window=TAIL_BATCH_WINDOW,
+                          idle_timeout=TAIL_IDLE_TIMEOUT, max_duration=TAIL_MAX_DURATION,
+                          max_retries=TAIL_MAX_RETRIES):
+    # Calls on_batch(state) at most once per window while changes arrive and returns the
+    # final state once cancelled, idle or out of time. The driver already resumes once
+    # after a transient error; longer outages reopen the stream from the last resume token.
+    state = {
+        "total": 0,
+        "counts": Counter(),
+        "latest": deque(maxlen=TAIL_MAX_SHOWN),
+        "started_at": time.monotonic(),
+        "reason": None,
+    }
+    token = None
+    retries = 0
+    pending = False
+    last_change = last_flush = state["started_at"]
+    while state["reason"] is None:
+        try:
+            async with collection.watch(
+                tail["pipeline"], full_document="updateLookup", resume_after=token, max_await_time_ms=TAIL_POLL_MS
+            ) as stream:
+                while state["reason"] is None:
+                    change = await stream.try_next()
+                    now = time.monotonic()
+                    if change is not None:
+                        state["total"] += 1
+                        state["counts"][change["operationType"]] += 1
+                        state["latest"].appendleft(event_view(change))
+                        last_change = now
+                        pending = True
+                        retries = 0
+                    # Advances even while nothing matches, so a reopen skips what was already seen
+                    token = stream.resume_token
+                    if pending and now - last_flush >= window:
+                        pending = False
+                        last_flush = now
+                        await on_batch(state)
+                    if cancelled.is_set():
+                        state["reason"] = "stopped"
+                    elif now - last_change >= idle_timeout:
+                        state["reason"] = "idle"
+                    elif now - state["started_at"] >= max_duration:
+                        state["reason"] = "time limit"
+        except ConnectionFailure:
+            retries += 1
+            if retries > max_retries:
+                raise
+            await asyncio.sleep(min(2 ** retries, 30))
+            if cancelled.is_set():
+                state["reason"] = "stopped"
+    return state
+
+
+def format_counts(counts):
+    return ", ".join(f"{count} {operation}" for operation, count in counts.most_common()) or "none yet"
@@ -1,38 +1,81 @@
 from pyrogram import Client, filters
 from pyrogram.types import Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery
-from motor.motor_asyncio import AsyncIOMotorClient
-from bson.json_util import dumps, loads
+from pymongo.errors import ExecutionTimeout, OperationFailure
+from bson.json_util import loads
 from bson.objectid import ObjectId
 import json
 import asyncio
 from aiohttp import web
 import humanize
 import os
+import tempfile
+import time
+
+from bulk_ops import BulkCancelled, count_matches, normalize_update, run_in_batches
+from callbacks import CallbackRouter
+from client_registry import ClientRegistry
+from concurrency import (
+    JOB_CLUSTER_CONCURRENCY, JOB_CONCURRENCY, QUERY_CLUSTER_CONCURRENCY, QUERY_CONCURRENCY, TAIL_CLUSTER_CONCURRENCY,
+    TAIL_CONCURRENCY, Backpressure, Busy, UserQueue,
+)
+from exporter import ExportCancelled, export_collection
+from importer import format_summary, import_file
+from indexes import IndexAdvisor, build_index, drop_index, list_indexes, parse_index_spec
+from live_tail import format_counts, parse_tail_spec, tail_collection
+from metrics import CommandMetrics, Gauge, LoopLagMonitor, instrument_handler, instrument_helper, render
+from metadata_cache import MetadataCache
+from outbox import MESSAGE_LIMIT, Outbox
+from pager import PAGE_SIZE, CountCache, fetch_page
+from query_profiler import SEARCH_MAX_TIME_MS, explain, format_explain, parse_search
+from renderer import render_documents
+from schema_analyzer import SchemaCache, format_schema, top_fields
+from session_store import SessionStore, create_backend
+from size_engine import SIZE_MAX_TIME_MS, SizeEngine
 
 API_ID = os.environ.get("API_ID")
 API_HASH = os.environ.get("API_HASH")
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
 app = Client("advanced_mongodb_bot", api_id=API_ID, api_hash=API_HASH, bot_token=BOT_TOKEN)
-user_sessions = {}
+user_sessions = SessionStore(create_backend())
+client_registry = ClientRegistry(event_listeners=[CommandMetrics()])
+size_engine = SizeEngine()
+count_cache = CountCache()
+metadata_cache = MetadataCache()
+schema_cache = SchemaCache()
+outbox = Outbox()
+index_advisor = IndexAdvisor()
+loop_lag = LoopLagMonitor()
+user_queue = UserQueue()
+callbacks = CallbackRouter()
+query_slots = Backpressure(QUERY_CONCURRENCY, QUERY_CLUSTER_CONCURRENCY, name="query")
+job_slots = Backpressure(JOB_CONCURRENCY, JOB_CLUSTER_CONCURRENCY, name="job")
+tail_slots = Backpressure(TAIL_CONCURRENCY, TAIL_CLUSTER_CONCURRENCY, name="tail")
+telegram_health = {"ok": False, "checked_at": 0.0}
 
-async def get_database_names(mongo_client):
-    return await mongo_client.list_database_names()
+HEALTH_MAX_LOOP_LAG = float(os.environ.get("HEALTH_MAX_LOOP_LAG", 1))
+HEALTH_TELEGRAM_TIMEOUT = float(os.environ.get("HEALTH_TELEGRAM_TIMEOUT", 5))
+HEALTH_TELEGRAM_INTERVAL = float(os.environ.get("HEALTH_TELEGRAM_INTERVAL", 30))
 
-async def get_collection_names(mongo_client, db_name):
-    db = mongo_client[db_name]
-    return await db.list_collection_names()
+Gauge("bot_event_loop_lag_seconds", "Most recent event loop scheduling delay.", lambda: loop_lag.lag)
+Gauge("bot_active_sessions", "User sessions held in memory.", lambda: len(user_sessions))
+Gauge("bot_mongo_pools", "Open MongoDB connection pools.", lambda: len(client_registry.stats()))
+Gauge("bot_background_jobs", "Running exports, imports, bulk writes and index builds.", lambda: len(background_jobs))
+Gauge("bot_callback_tokens", "Interned callback button arguments held in memory.", lambda: len(callbacks.tokens))
+Gauge("bot_live_tails", "Open change streams tailing a collection.", lambda: tail_slots.active)
+Gauge("bot_query_slots_in_use", "Expensive queries currently holding a concurrency slot.", lambda: query_slots.active)
+background_jobs = {}
 
-async def get_documents(mongo_client, db_name, collection_name, limit=5, skip=0, query=None):
+@instrument_helper
+async def get_documents(mongo_client, db_name, collection_name, limit=5, skip=0, query=None, projection=None,
+                        sort=None, max_time_ms=SEARCH_MAX_TIME_MS):
     db = mongo_client[db_name]
     collection = db[collection_name]
-    if query:
-        cursor = collection.find(query).skip(skip).limit(limit)
-    else:
-        cursor = collection.find().skip(skip).limit(limit)
+    cursor = collection.find(query or {}, projection, sort=sort, max_time_ms=max_time_ms).skip(skip).limit(limit)
     documents = await cursor.to_list(length=limit)
     return documents
 
+@instrument_helper
 async def get_document_count(mongo_client, db_name, collection_name, query=None):
     db = mongo_client[db_name]
     collection = db[collection_name]
@@ -40,130 +83,248 @@ async def get_document_count(mongo_client, db_name, collection_name, query=None)
         return await collection.count_documents(query)
     return await collection.count_documents({})
 
+@instrument_helper
 async def insert_document(mongo_client, db_name, collection_name, document):
     db = mongo_client[db_name]
     collection = db[collection_name]
     result = await collection.insert_one(document)
     return result.inserted_id
 
+@instrument_helper
 async def update_document(mongo_client, db_name, collection_name, filter_query, update_data):
     db = mongo_client[db_name]
     collection = db[collection_name]
-    result = await collection.update_one(filter_query, {"$set": update_data})
+    result = await collection.update_one(filter_query, normalize_update(update_data))
     return result.modified_count
 
+@instrument_helper
 async def delete_document(mongo_client, db_name, collection_name, filter_query):
     db = mongo_client[db_name]
     collection = db[collection_name]
     result = await collection.delete_one(filter_query)
     return result.deleted_count
 
+@instrument_helper
 async def delete_all_documents(mongo_client, db_name, collection_name):
     db = mongo_client[db_name]
     collection = db[collection_name]
     result = await collection.delete_many({})
     return result.deleted_count
 
+@instrument_helper
 async def delete_collection(mongo_client, db_name, collection_name):
     db = mongo_client[db_name]
     await db.drop_collection(collection_name)
 
+@instrument_helper
 async def delete_database(mongo_client, db_name):
     await mongo_client.drop_database(db_name)
 
+@instrument_helper
 async def create_collection(mongo_client, db_name, collection_name):
     db = mongo_client[db_name]
     await db.create_collection(collection_name)
 
+def invalidate_collection_caches(session, db_name, coll_name=None):
+    cluster_key = session.mongo_handle.key
+    size_engine.invalidate(cluster_key, db_name, coll_name)
+    count_cache.invalidate(cluster_key, db_name, coll_name)
+
+def invalidate_namespace_caches(session, db_name, coll_name=None):
+    metadata_cache.invalidate(session.mongo_handle.key, db_name)
+    schema_cache.invalidate(session.mongo_handle.key, db_name, coll_name)
+    invalidate_collection_caches(session, db_name, coll_name)
+
+async def ensure_connected(session):
+    # Sessions restored after a restart or eviction reconnect on first use
+    if session.mongo_handle is None and session.mongo_url:
+        session.mongo_handle = await client_registry.acquire(session.mongo_url)
+
+def record_query(session, query, sort=None):
+    index_advisor.record(session.mongo_handle.key, session.db, session.coll, query, sort)
+
+async def get_session(user_id):
+    session = user_sessions.get(user_id)
+    if session is not None:
+        await ensure_connected(session)
+    return session
+
 async def split_and_send_message(client, chat_id, text, reply_markup=None):
-    max_length = 4096
-    if len(text) <= max_length:
-        await client.send_message(chat_id, text, reply_markup=reply_markup)
+    return await outbox.send_text(client, chat_id, text, reply_markup=reply_markup)
+
+async def send_bulk_preview(client, chat_id, session):
+    db_name, coll_name = session.db, session.coll
+    user_sessions.update(session, bulk_db=db_name, bulk_coll=coll_name)
+    collection = session.mongo_client[db_name][coll_name]
+    async with query_slots.slot(session.mongo_handle.key):
+        matches = await count_matches(collection, session.bulk_filter)
+    verb = "update" if session.bulk_action == "update" else "delete"
+    if matches is None:
+        summary = f"Too many documents match to count quickly in {db_name}.{coll_name}."
     else:
-        parts = [text[i:i+max_length] for i in range(0, len(text), max_length)]
-        for i, part in enumerate(parts):
-            if i == len(parts) - 1:
-                await client.send_message(chat_id, part, reply_markup=reply_markup)
-            else:
-                await client.send_message(chat_id, part)
+        summary = f"{matches} document(s) in {db_name}.{coll_name} match the filter."
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton(f"Yes, {verb} matching documents", callback_data=callbacks.data("confirm_bulk", db_name, coll_name))],
+        [InlineKeyboardButton("No, cancel", callback_data=callbacks.data("coll", db_name, coll_name))]
+    ])
+    await outbox.send_message(
+        client, chat_id, f"{summary}\nDo you want to {verb} all of them? This action cannot be undone.",
+        reply_markup=keyboard
+    )
 
 @app.on_message(filters.command("start"))
+@instrument_handler
+@user_queue.serialized
 async def start_command(client, message: Message):
     await message.reply_text("Welcome to the Advanced MongoDB Management Bot!\nPlease enter your MongoDB URL to begin.")
-    user_sessions[message.from_user.id] = {"state": "awaiting_mongo_url"}
+    user_sessions.create(message.from_user.id, state="awaiting_mongo_url")
 
-@app.on_message(filters.text & ~filters.command("start"))
+@app.on_message(filters.command("pools"))
+@instrument_handler
+@user_queue.serialized
+async def pools_command(client, message: Message):
+    pools = client_registry.stats()
+    if not pools:
+        await message.reply_text("No open connection pools.")
+        return
+    lines = [f"Open connection pools: {len(pools)}", ""]
+    for pool in pools:
+        lines.append(
+            f"{pool['key']}: {pool['refs']} session(s), max {pool['max_pool_size']} connections, "
+            f"idle {humanize.naturaldelta(pool['idle'])}, open {humanize.naturaldelta(pool['age'])}"
+        )
+    await message.reply_text("\n".join(lines))
+
+@app.on_message(filters.text & ~filters.command(["start", "pools"]))
+@instrument_handler
+@user_queue.serialized
 async def handle_text_input(client, message: Message):
-    user_id = message.from_user.id
-    if user_id in user_sessions:
-        session = user_sessions[user_id]
-        state = session.get("state")
+    session = user_sessions.get(message.from_user.id)
+    if session is not None:
+        state = session.state
+        retry = False
         try:
+            await ensure_connected(session)
             if state == "awaiting_mongo_url":
                 mongo_url = message.text
-                mongo_client = AsyncIOMotorClient(mongo_url)
-                await mongo_client.server_info()  # Test the connection
-                session["mongo_client"] = mongo_client
+                handle = await client_registry.acquire(mongo_url)
+                session.release()
+                session.mongo_handle = handle
+                session.mongo_url = mongo_url
                 keyboard = InlineKeyboardMarkup([
                     [InlineKeyboardButton("Manage Databases", callback_data="manage_databases")],
                     [InlineKeyboardButton("Manage Collections", callback_data="manage_collections")],
                     [InlineKeyboardButton("Manage Documents", callback_data="manage_documents")]
                 ])
                 await message.reply_text("Connected successfully! Please select an option:", reply_markup=keyboard)
-                session["state"] = "main_menu"
+                session.state = "main_menu"
             elif state == "awaiting_new_db_name":
                 new_db_name = message.text
-                await create_collection(session["mongo_client"], new_db_name, "dummy_collection")
+                await create_collection(session.mongo_client, new_db_name, "dummy_collection")
+                invalidate_namespace_caches(session, new_db_name, "dummy_collection")
                 await message.reply_text(f"Database '{new_db_name}' has been created.")
             elif state == "awaiting_new_coll_name":
-                db_name = session["db"]
+                db_name = session.db
                 new_coll_name = message.text
-                await create_collection(session["mongo_client"], db_name, new_coll_name)
+                await create_collection(session.mongo_client, db_name, new_coll_name)
+                invalidate_namespace_caches(session, db_name, new_coll_name)
                 await message.reply_text(f"Collection '{new_coll_name}' has been created in database '{db_name}'.")
             elif state == "awaiting_search":
-                db_name = session["db"]
-                coll_name = session["coll"]
-                query = json.loads(message.text)
-                documents = await get_documents(session["mongo_client"], db_name, coll_name, query=query)
-                response = f"Search results in {db_name}.{coll_name}:\n\n"
-                for doc in documents:
-                    response += json.dumps(json.loads(dumps(doc)), indent=2) + "\n\n"
-                await split_and_send_message(client, message.chat.id, response)
+                db_name = session.db
+                coll_name = session.coll
+                spec = json.loads(message.text)
+                search = parse_search(spec)
+                session.search_query = spec
+                record_query(session, search["filter"], search["sort"])
+                explain_button = InlineKeyboardButton("Explain", callback_data=callbacks.data("explain_search", db_name, coll_name, spec))
+                keyboard = InlineKeyboardMarkup([
+                    [explain_button],
+                    [InlineKeyboardButton("Export Results (JSONL)", callback_data=callbacks.data("export", db_name, coll_name, "jsonl", spec)),
+                     InlineKeyboardButton("Export Results (CSV)", callback_data=callbacks.data("export", db_name, coll_name, "csv", spec))]
+                ])
+                try:
+                    async with query_slots.slot(session.mongo_handle.key):
+                        documents = await get_documents(
+                            session.mongo_client, db_name, coll_name, limit=search["limit"], query=search["filter"],
+                            projection=search["projection"], sort=search["sort"]
+                        )
+                except ExecutionTimeout:
+                    await message.reply_text(
+                        f"The search did not finish within {SEARCH_MAX_TIME_MS} ms. "
+                        "Narrow the filter or add an index; Explain shows the plan the server picked.",
+                        reply_markup=InlineKeyboardMarkup([[explain_button]])
+                    )
+                    return
+                response = render_documents(documents, header=f"Search results in {db_name}.{coll_name}:\n\n")
+                await split_and_send_message(client, message.chat.id, response, reply_markup=keyboard)
             elif state == "awaiting_insert":
-                db_name = session["db"]
-                coll_name = session["coll"]
+                db_name = session.db
+                coll_name = session.coll
                 document = json.loads(message.text)
-                inserted_id = await insert_document(session["mongo_client"], db_name, coll_name, document)
+                inserted_id = await insert_document(session.mongo_client, db_name, coll_name, document)
+                invalidate_collection_caches(session, db_name, coll_name)
                 await message.reply_text(f"Document inserted successfully. Inserted ID: {inserted_id}")
             elif state == "awaiting_update_filter":
-                session["update_filter"] = json.loads(message.text)
-                session["state"] = "awaiting_update_data"
+                session.update(update_filter=json.loads(message.text), state="awaiting_update_data")
                 await message.reply_text("Now enter the update data in JSON format.\nExample: {\"$set\": {\"age\": 31}}")
                 return
             elif state == "awaiting_update_data":
-                db_name = session["db"]
-                coll_name = session["coll"]
-                update_filter = session["update_filter"]
+                db_name = session.db
+                coll_name = session.coll
+                update_filter = session.update_filter
                 update_data = json.loads(message.text)
-                modified_count = await update_document(session["mongo_client"], db_name, coll_name, update_filter, update_data)
+                modified_count = await update_document(session.mongo_client, db_name, coll_name, update_filter, update_data)
+                record_query(session, update_filter)
                 await message.reply_text(f"Update complete. Modified {modified_count} document(s).")
+            elif state == "awaiting_index_spec":
+                keys, options = parse_index_spec(json.loads(message.text))
+                await start_index_build(client, message.chat.id, session, session.db, session.coll, keys, options)
+            elif state == "awaiting_tail_filter":
+                await start_tail(client, message.chat.id, session, parse_tail_spec(json.loads(message.text)))
+            elif state == "awaiting_update_many_filter":
+                session.update(bulk_filter=json.loads(message.text), state="awaiting_update_many_data")
+                await message.reply_text(
+                    "Now enter the update to apply to every matching document.\n"
+                    "Example: {\"$set\": {\"active\": false}}\n"
+                    "Update operators and aggregation pipelines ([...]) are applied as given; a plain document is applied with $set."
+                )
+            elif state == "awaiting_update_many_data":
+                session.update(bulk_action="update", bulk_update=normalize_update(json.loads(message.text)))
+                await send_bulk_preview(client, message.chat.id, session)
+            elif state == "awaiting_delete_many":
+                session.update(bulk_action="delete", bulk_filter=json.loads(message.text), bulk_update=None)
+                await send_bulk_preview(client, message.chat.id, session)
             elif state == "awaiting_delete":
-                db_name = session["db"]
-                coll_name = session["coll"]
+                db_name = session.db
+                coll_name = session.coll
                 delete_filter = json.loads(message.text)
-                deleted_count = await delete_document(session["mongo_client"], db_name, coll_name, delete_filter)
+                record_query(session, delete_filter)
+                deleted_count = await delete_document(session.mongo_client, db_name, coll_name, delete_filter)
+                invalidate_collection_caches(session, db_name, coll_name)
                 await message.reply_text(f"Delete operation complete. Deleted {deleted_count} document(s).")
         except json.JSONDecodeError:
             await message.reply_text("Invalid JSON format. Please try again.")
+        except Busy:
+            # Keep the prompt open so the same input can simply be sent again
+            retry = True
+            await message.reply_text("The bot is busy right now. Please send that again in a moment.")
         except Exception as e:
             await message.reply_text(f"An error occurred: {str(e)}")
         finally:
-            if state!= "awaiting_update_data" and state!= "main_menu":
-                session["state"] = "main_menu"
+            # Steps that ask for more input have already moved the state on
+            if session.state == state and state != "main_menu" and not retry:
+                session.state = "main_menu"
+            user_sessions.save(session)
     else:
         await message.reply_text("Please use the /start command to begin.")
 
-@app.on_callback_query(filters.regex("^manage_databases$"))
+@app.on_callback_query()
+@user_queue.serialized
+async def route_callback(client, callback_query: CallbackQuery):
+    await callbacks.dispatch(client, callback_query)
+
+@callbacks.route("manage_databases")
+@instrument_handler
 async def manage_databases(client, callback_query: CallbackQuery):
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("List Databases", callback_data="list_databases")],
@@ -173,7 +334,8 @@ async def manage_databases(client, callback_query: CallbackQuery):
     ])
     await callback_query.edit_message_text("Database Management Options:", reply_markup=keyboard)
 
-@app.on_callback_query(filters.regex("^manage_collections$"))
+@callbacks.route("manage_collections")
+@instrument_handler
 async def manage_collections(client, callback_query: CallbackQuery):
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("List Collections", callback_data="list_collections")],
@@ -183,173 +345,254 @@ async def manage_collections(client, callback_query: CallbackQuery):
     ])
     await callback_query.edit_message_text("Collection Management Options:", reply_markup=keyboard)
 
-@app.on_callback_query(filters.regex("^manage_documents$"))
+@callbacks.route("manage_documents")
+@instrument_handler
 async def manage_documents(client, callback_query: CallbackQuery):
-    keyboard = InlineKeyboardMarkup([
+    session = await get_session(callback_query.from_user.id)
+    keyboard = [
         [InlineKeyboardButton("View Documents", callback_data="view_documents")],
         [InlineKeyboardButton("Search Documents", callback_data="search_documents")],
         [InlineKeyboardButton("Insert Document", callback_data="insert_document")],
         [InlineKeyboardButton("Update Document", callback_data="update_document")],
         [InlineKeyboardButton("Delete Document", callback_data="delete_document")],
         [InlineKeyboardButton("Delete All Documents", callback_data="delete_all_documents")],
-        [InlineKeyboardButton("Total Size", callback_data="total_size")],
-        [InlineKeyboardButton("Back to Main Menu", callback_data="main_menu")]
-    ])
+    ]
+    # Total Size is bound to the collection open right now, if there is one
+    if session.db and session.coll:
+        keyboard.append([InlineKeyboardButton("Total Size", callback_data=callbacks.data("total_size", session.db, session.coll))])
+    keyboard.append([InlineKeyboardButton("Back to Main Menu", callback_data="main_menu")])
+    keyboard = InlineKeyboardMarkup(keyboard)
     await callback_query.edit_message_text("Document Management Options:", reply_markup=keyboard)
 
-@app.on_callback_query(filters.regex("^total_size$"))
-async def get_total_size(client, callback_query: CallbackQuery):
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    db_name = user_sessions[callback_query.from_user.id]["db"]
-    coll_name = user_sessions[callback_query.from_user.id]["coll"]
-    db = mongo_client[db_name]
-    collection = db[coll_name]
-    total_size = 0
-    for file in await collection.find().to_list(length=None):
-        if "file_size" in file:
-            total_size += file["file_size"]
-    humanized_size = humanize.naturalsize(total_size)
-    await callback_query.edit_message_text(f"Total size of stored files: {humanized_size}")
-
-@app.on_callback_query(filters.regex("^list_databases$"))
+def format_size_report(db_name, coll_name, report, age):
+    lines = [
+        f"Size of {db_name}.{coll_name}:",
+        "",
+    ]
+    if report["total"] is None:
+        # The sum timed out; the storage stats below come from metadata and are still shown
+        lines.append(f"Total size of stored files: took longer than {SIZE_MAX_TIME_MS // 1000}s to compute")
+    else:
+        lines.append(f"Total size of stored files: {humanize.naturalsize(report['total'])} ({report['files']} files)")
+    stats = report["stats"]
+    if stats:
+        lines += [
+            f"Documents: {stats['count']}",
+            f"Data size: {humanize.naturalsize(stats['size'])}",
+            f"Storage size: {humanize.naturalsize(stats['storageSize'])}",
+            f"Index size: {humanize.naturalsize(stats['totalIndexSize'])} ({stats['nindexes']} indexes)",
+        ]
+    lines += ["", f"Computed {humanize.naturaldelta(age)} ago"]
+    return "\n".join(lines)
+
+@callbacks.route("total_size")
+@instrument_handler
+async def get_total_size(client, callback_query: CallbackQuery, db_name, coll_name, refresh=False):
+    session = await get_session(callback_query.from_user.id)
+    collection = session.mongo_client[db_name][coll_name]
+    cache_key = size_engine.key(session.mongo_handle.key, collection)
+    async with query_slots.slot(session.mongo_handle.key):
+        report = await size_engine.get(session.mongo_handle.key, collection, refresh=refresh)
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Refresh", callback_data=callbacks.data("total_size", db_name, coll_name, True))],
+        [InlineKeyboardButton("Back to Collection Options", callback_data=callbacks.data("coll", db_name, coll_name))]
+    ])
+    text = format_size_report(db_name, coll_name, report, size_engine.age(cache_key))
+    if text == callback_query.message.text:
+        await callback_query.answer("Already up to date")
+        return
+    await callback_query.edit_message_text(text, reply_markup=keyboard)
+
+@callbacks.route("schema")
+@instrument_handler
+async def analyze_schema(client, callback_query: CallbackQuery, db_name, coll_name, refresh=False):
+    session = await get_session(callback_query.from_user.id)
+    collection = session.mongo_client[db_name][coll_name]
+    cache_key = schema_cache.key(session.mongo_handle.key, collection)
+    async with query_slots.slot(session.mongo_handle.key):
+        report = await schema_cache.get(session.mongo_handle.key, collection, refresh=refresh)
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Refresh", callback_data=callbacks.data("schema", db_name, coll_name, True))],
+        [InlineKeyboardButton("Search Documents", callback_data=callbacks.data("search", db_name, coll_name))],
+        [InlineKeyboardButton("Back to Collection Options", callback_data=callbacks.data("coll", db_name, coll_name))]
+    ])
+    text = format_schema(f"{db_name}.{coll_name}", report, schema_cache.age(cache_key))
+    await split_and_send_message(client, callback_query.message.chat.id, text, reply_markup=keyboard)
+    await callback_query.answer()
+
+@callbacks.route("list_databases")
+@instrument_handler
 async def list_databases_callback(client, callback_query: CallbackQuery):
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    databases = await get_database_names(mongo_client)
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
+    databases = await metadata_cache.database_names(session.mongo_handle.key, mongo_client)
     keyboard = []
     for db in databases:
-        keyboard.append([InlineKeyboardButton(db, callback_data=f"db:{db}")])
+        keyboard.append([InlineKeyboardButton(db, callback_data=callbacks.data("db", db))])
     keyboard.append([InlineKeyboardButton("Back to Database Management", callback_data="manage_databases")])
     await callback_query.edit_message_text("Select a database:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^create_database$"))
+@callbacks.route("create_database")
+@instrument_handler
 async def create_database_prompt(client, callback_query: CallbackQuery):
-    user_sessions[callback_query.from_user.id]["state"] = "awaiting_new_db_name"
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, state="awaiting_new_db_name")
     await callback_query.edit_message_text("Please enter the name for the new database:")
 
-@app.on_callback_query(filters.regex("^delete_database$"))
+@callbacks.route("delete_database")
+@instrument_handler
 async def delete_database_prompt(client, callback_query: CallbackQuery):
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    databases = await get_database_names(mongo_client)
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
+    databases = await metadata_cache.database_names(session.mongo_handle.key, mongo_client)
     keyboard = []
     for db in databases:
-        keyboard.append([InlineKeyboardButton(db, callback_data=f"confirm_delete_db:{db}")])
+        keyboard.append([InlineKeyboardButton(db, callback_data=callbacks.data("confirm_delete_db", db))])
     keyboard.append([InlineKeyboardButton("Cancel", callback_data="manage_databases")])
     await callback_query.edit_message_text("Select a database to delete:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^confirm_delete_db:"))
-async def confirm_delete_database(client, callback_query: CallbackQuery):
-    db_name = callback_query.data.split(":")[1]
+@callbacks.route("confirm_delete_db")
+@instrument_handler
+async def confirm_delete_database(client, callback_query: CallbackQuery, db_name):
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Yes, delete database", callback_data=f"execute_delete_db:{db_name}")],
+        [InlineKeyboardButton("Yes, delete database", callback_data=callbacks.data("execute_delete_db", db_name))],
         [InlineKeyboardButton("No, cancel", callback_data="manage_databases")]
     ])
     await callback_query.edit_message_text(f"Are you sure you want to delete the database '{db_name}'? This action cannot be undone.", reply_markup=keyboard)
 
-@app.on_callback_query(filters.regex("^execute_delete_db:"))
-async def execute_delete_database(client, callback_query: CallbackQuery):
-    db_name = callback_query.data.split(":")[1]
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
+@callbacks.route("execute_delete_db")
+@instrument_handler
+async def execute_delete_database(client, callback_query: CallbackQuery, db_name):
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
     await delete_database(mongo_client, db_name)
+    invalidate_namespace_caches(session, db_name)
     await callback_query.edit_message_text(f"Database '{db_name}' has been deleted.")
 
-@app.on_callback_query(filters.regex("^db:"))
-async def list_collections_callback(client, callback_query: CallbackQuery):
-    db_name = callback_query.data.split(":")[1]
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    collections = await get_collection_names(mongo_client, db_name)
+@callbacks.route("db")
+@instrument_handler
+async def list_collections_callback(client, callback_query: CallbackQuery, db_name):
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
+    collections = await metadata_cache.collection_names(session.mongo_handle.key, mongo_client, db_name)
     keyboard = []
     for coll in collections:
-        keyboard.append([InlineKeyboardButton(coll, callback_data=f"coll:{db_name}:{coll}")])
+        keyboard.append([InlineKeyboardButton(coll, callback_data=callbacks.data("coll", db_name, coll))])
     keyboard.append([InlineKeyboardButton("Back to Databases", callback_data="list_databases")])
     await callback_query.edit_message_text(f"Collections in {db_name}:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^create_collection$"))
+@callbacks.route("create_collection")
+@instrument_handler
 async def create_collection_prompt(client, callback_query: CallbackQuery):
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    databases = await get_database_names(mongo_client)
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
+    databases = await metadata_cache.database_names(session.mongo_handle.key, mongo_client)
     keyboard = []
     for db in databases:
-        keyboard.append([InlineKeyboardButton(db, callback_data=f"new_coll_db:{db}")])
+        keyboard.append([InlineKeyboardButton(db, callback_data=callbacks.data("new_coll_db", db))])
     keyboard.append([InlineKeyboardButton("Cancel", callback_data="manage_collections")])
     await callback_query.edit_message_text("Select a database for the new collection:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^new_coll_db:"))
-async def new_collection_name_prompt(client, callback_query: CallbackQuery):
-    db_name = callback_query.data.split(":")[1]
-    user_sessions[callback_query.from_user.id].update({"state": "awaiting_new_coll_name", "db": db_name})
+@callbacks.route("new_coll_db")
+@instrument_handler
+async def new_collection_name_prompt(client, callback_query: CallbackQuery, db_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, state="awaiting_new_coll_name", db=db_name)
     await callback_query.edit_message_text(f"Please enter the name for the new collection in database '{db_name}':")
 
-@app.on_callback_query(filters.regex("^delete_collection$"))
+@callbacks.route("delete_collection")
+@instrument_handler
 async def delete_collection_prompt(client, callback_query: CallbackQuery):
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    databases = await get_database_names(mongo_client)
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
+    databases = await metadata_cache.database_names(session.mongo_handle.key, mongo_client)
     keyboard = []
     for db in databases:
-        keyboard.append([InlineKeyboardButton(db, callback_data=f"del_coll_db:{db}")])
+        keyboard.append([InlineKeyboardButton(db, callback_data=callbacks.data("del_coll_db", db))])
     keyboard.append([InlineKeyboardButton("Cancel", callback_data="manage_collections")])
     await callback_query.edit_message_text("Select a database to delete a collection from:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^del_coll_db:"))
-async def delete_collection_select(client, callback_query: CallbackQuery):
-    db_name = callback_query.data.split(":")[1]
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    collections = await get_collection_names(mongo_client, db_name)
+@callbacks.route("del_coll_db")
+@instrument_handler
+async def delete_collection_select(client, callback_query: CallbackQuery, db_name):
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
+    collections = await metadata_cache.collection_names(session.mongo_handle.key, mongo_client, db_name)
     keyboard = []
     for coll in collections:
-        keyboard.append([InlineKeyboardButton(coll, callback_data=f"confirm_delete_coll:{db_name}:{coll}")])
+        keyboard.append([InlineKeyboardButton(coll, callback_data=callbacks.data("confirm_delete_coll", db_name, coll))])
     keyboard.append([InlineKeyboardButton("Cancel", callback_data="manage_collections")])
     await callback_query.edit_message_text(f"Select a collection to delete from database '{db_name}':", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^confirm_delete_coll:"))
-async def confirm_delete_collection(client, callback_query: CallbackQuery):
-    db_name, coll_name = callback_query.data.split(":")[1:]
+@callbacks.route("confirm_delete_coll")
+@instrument_handler
+async def confirm_delete_collection(client, callback_query: CallbackQuery, db_name, coll_name):
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Yes, delete collection", callback_data=f"execute_delete_coll:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("No, cancel", callback_data=f"del_coll_db:{db_name}")]
+        [InlineKeyboardButton("Yes, delete collection", callback_data=callbacks.data("execute_delete_coll", db_name, coll_name))],
+        [InlineKeyboardButton("No, cancel", callback_data=callbacks.data("del_coll_db", db_name))]
     ])
     await callback_query.edit_message_text(f"Are you sure you want to delete the collection '{coll_name}' from database '{db_name}'? This action cannot be undone.", reply_markup=keyboard)
 
-@app.on_callback_query(filters.regex("^execute_delete_coll:"))
-async def execute_delete_collection(client, callback_query: CallbackQuery):
-    db_name, coll_name = callback_query.data.split(":")[1:]
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
+@callbacks.route("execute_delete_coll")
+@instrument_handler
+async def execute_delete_collection(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
     await delete_collection(mongo_client, db_name, coll_name)
+    invalidate_namespace_caches(session, db_name, coll_name)
     await callback_query.edit_message_text(f"Collection '{coll_name}' has been deleted from database '{db_name}'.")
 
-@app.on_callback_query(filters.regex("^coll:"))
-async def show_collection_options(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
+@callbacks.route("coll")
+@instrument_handler
+async def show_collection_options(client, callback_query: CallbackQuery, db_name, coll_name):
     keyboard = [
-        [InlineKeyboardButton("View Documents", callback_data=f"view:{db_name}:{coll_name}:0")],
-        [InlineKeyboardButton("Search Documents", callback_data=f"search:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("Insert Document", callback_data=f"insert:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("Update Document", callback_data=f"update:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("Delete Document", callback_data=f"delete:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("Delete All Documents", callback_data=f"delete_all:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("Total Size", callback_data="total_size")],
-        [InlineKeyboardButton("Back to Collections", callback_data=f"db:{db_name}")]
+        [InlineKeyboardButton("View Documents", callback_data=callbacks.data("view", db_name, coll_name, 0))],
+        [InlineKeyboardButton("Search Documents", callback_data=callbacks.data("search", db_name, coll_name))],
+        [InlineKeyboardButton("Live Tail", callback_data=callbacks.data("tail", db_name, coll_name))],
+        [InlineKeyboardButton("Insert Document", callback_data=callbacks.data("insert", db_name, coll_name))],
+        [InlineKeyboardButton("Import File", callback_data=callbacks.data("import", db_name, coll_name))],
+        [InlineKeyboardButton("Update Document", callback_data=callbacks.data("update", db_name, coll_name))],
+        [InlineKeyboardButton("Update Many", callback_data=callbacks.data("update_many", db_name, coll_name))],
+        [InlineKeyboardButton("Delete Document", callback_data=callbacks.data("delete", db_name, coll_name))],
+        [InlineKeyboardButton("Delete Many", callback_data=callbacks.data("delete_many", db_name, coll_name))],
+        [InlineKeyboardButton("Delete All Documents", callback_data=callbacks.data("delete_all", db_name, coll_name))],
+        [InlineKeyboardButton("Total Size", callback_data=callbacks.data("total_size", db_name, coll_name))],
+        [InlineKeyboardButton("Analyze Schema", callback_data=callbacks.data("schema", db_name, coll_name))],
+        [InlineKeyboardButton("Export", callback_data=callbacks.data("export_menu", db_name, coll_name))],
+        [InlineKeyboardButton("Indexes", callback_data="indexes_menu")],
+        [InlineKeyboardButton("Back to Collections", callback_data=callbacks.data("db", db_name))]
     ]
-    user_sessions[callback_query.from_user.id].update({"db": db_name, "coll": coll_name})
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name)
     await callback_query.edit_message_text(f"Options for {db_name}.{coll_name}:", reply_markup=InlineKeyboardMarkup(keyboard))
 
-@app.on_callback_query(filters.regex("^view:"))
-async def view_documents(client, callback_query: CallbackQuery):
-    _, db_name, coll_name, skip = callback_query.data.split(":")
-    skip = int(skip)
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
-    documents = await get_documents(mongo_client, db_name, coll_name, limit=5, skip=skip)
-    total_docs = await get_document_count(mongo_client, db_name, coll_name)
+@callbacks.route("view")
+@instrument_handler
+async def view_documents(client, callback_query: CallbackQuery, db_name, coll_name, page, direction=None, anchor=None):
+    session = await get_session(callback_query.from_user.id)
+    collection = session.mongo_client[db_name][coll_name]
+    async with query_slots.slot(session.mongo_handle.key):
+        if direction == "p":
+            documents, has_prev = await fetch_page(collection, PAGE_SIZE, before=anchor)
+            has_next = True
+        elif direction == "n":
+            documents, has_next = await fetch_page(collection, PAGE_SIZE, after=anchor)
+            has_prev = page > 0
+        else:
+            documents, has_next = await fetch_page(collection, PAGE_SIZE, skip=page * PAGE_SIZE)
+            has_prev = page > 0
+        total_docs = await count_cache.get(session.mongo_handle.key, collection)
 
-    response = f"Documents in {db_name}.{coll_name} (Showing {skip+1}-{min(skip+5, total_docs)} of {total_docs}):\n\n"
-    for doc in documents:
-        response += json.dumps(json.loads(dumps(doc)), indent=2) + "\n\n"
+    first = page * PAGE_SIZE
+    header = f"Documents in {db_name}.{coll_name} (Showing {first+1}-{first+len(documents)} of about {total_docs}):\n\n"
+    response = render_documents(documents, header=header)
 
     keyboard = []
-    if skip > 0:
-        keyboard.append([InlineKeyboardButton("Previous", callback_data=f"view:{db_name}:{coll_name}:{max(0, skip-5)}")])
-    if skip + 5 < total_docs:
-        keyboard.append([InlineKeyboardButton("Next", callback_data=f"view:{db_name}:{coll_name}:{skip+5}")])
-    keyboard.append([InlineKeyboardButton("Back to Collection Options", callback_data=f"coll:{db_name}:{coll_name}")])
+    if has_prev and documents:
+        keyboard.append([InlineKeyboardButton("Previous", callback_data=callbacks.data("view", db_name, coll_name, page - 1, "p", documents[0]["_id"]))])
+    if has_next and documents:
+        keyboard.append([InlineKeyboardButton("Next", callback_data=callbacks.data("view", db_name, coll_name, page + 1, "n", documents[-1]["_id"]))])
+    keyboard.append([InlineKeyboardButton("Back to Collection Options", callback_data=callbacks.data("coll", db_name, coll_name))])
 
     await split_and_send_message(
         client,
@@ -359,62 +602,535 @@ async def view_documents(client, callback_query: CallbackQuery):
     )
     await callback_query.answer()
 
-@app.on_callback_query(filters.regex("^search:"))
-async def search_prompt(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
-    user_sessions[callback_query.from_user.id].update({"db": db_name, "coll": coll_name, "state": "awaiting_search"})
-    await callback_query.edit_message_text(
+@callbacks.route("search")
+@instrument_handler
+async def search_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_search")
+    text = (
         f"Please enter your search query for {db_name}.{coll_name} in JSON format.\n"
-        "Example: {\"name\": \"John\"}"
+        "Example: {\"name\": \"John\"}\n"
+        "To choose fields, order and count, wrap the filter:\n"
+        "{\"filter\": {\"name\": \"John\"}, \"projection\": {\"name\": 1}, \"sort\": {\"age\": -1}, \"limit\": 10}"
+    )
+    # Only a schema that was already analyzed; searching never waits for a sample
+    schema = schema_cache.peek(session.mongo_handle.key, db_name, coll_name)
+    if schema and schema["fields"]:
+        text += f"\nFields in this collection include: {', '.join(top_fields(schema))}"
+    await callback_query.edit_message_text(text)
+
+@callbacks.route("explain_search")
+@instrument_handler
+async def explain_search(client, callback_query: CallbackQuery, db_name, coll_name, spec):
+    session = await get_session(callback_query.from_user.id)
+    collection = session.mongo_client[db_name][coll_name]
+    async with query_slots.slot(session.mongo_handle.key):
+        report = await explain(collection, parse_search(spec))
+    await callback_query.answer()
+    await outbox.send_message(client, callback_query.message.chat.id, format_explain(f"{db_name}.{coll_name}", report))
+
+@callbacks.route("tail")
+@instrument_handler
+async def tail_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_tail_filter")
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Watch Everything", callback_data="start_tail")],
+        [InlineKeyboardButton("Back to Collection Options", callback_data=callbacks.data("coll", db_name, coll_name))]
+    ])
+    await callback_query.edit_message_text(
+        f"Live tail shows inserts, updates, replaces and deletes in {db_name}.{coll_name} as they happen.\n"
+        "Tap Watch Everything, or enter a filter for the changed documents in JSON format.\n"
+        "Example: {\"status\": \"failed\"}\n"
+        "To choose fields, wrap the filter: {\"filter\": {\"status\": \"failed\"}, \"projection\": {\"status\": 1, \"error\": 1}}\n"
+        "The tail needs a replica set or sharded cluster and stops by itself after a while without changes.",
+        reply_markup=keyboard
+    )
+
+@callbacks.route("start_tail")
+@instrument_handler
+async def start_tail_everything(client, callback_query: CallbackQuery):
+    session = await get_session(callback_query.from_user.id)
+    await start_tail(client, callback_query.message.chat.id, session, parse_tail_spec({}))
+    user_sessions.update(session, state="main_menu")
+    await callback_query.answer()
+
+def format_tail(name, state, status):
+    header = (
+        f"Live tail of {name} ({status}): {state['total']} change(s) in "
+        f"{humanize.naturaldelta(time.monotonic() - state['started_at'])} - {format_counts(state['counts'])}\n"
     )
+    if state["latest"]:
+        header += "Latest first:\n\n"
+    return render_documents(state["latest"], header=header, budget=MESSAGE_LIMIT)
+
+async def tail_to_chat(client, chat_id, collection, tail, cancelled):
+    name = f"{collection.database.name}.{collection.name}"
+    stop_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Stop", callback_data="cancel_job")]])
+    status = await outbox.send_message(client, chat_id, f"Live tail of {name}: waiting for changes...", reply_markup=stop_keyboard)
+
+    async def on_batch(state):
+        await outbox.edit_message_text(client, chat_id, status.id, format_tail(name, state, "live"), reply_markup=stop_keyboard)
+
+    try:
+        state = await tail_collection(collection, tail, on_batch, cancelled)
+    except Exception as e:
+        await outbox.edit_message_text(client, chat_id, status.id, f"Live tail of {name} failed: {str(e)}")
+        return
+    await outbox.edit_message_text(client, chat_id, status.id, format_tail(name, state, f"ended: {state['reason']}"))
+
+async def start_tail(client, chat_id, session, tail):
+    if session.user_id in background_jobs:
+        await outbox.send_message(client, chat_id, "Another long-running operation is already in progress.")
+        return
+    collection = session.mongo_client[session.db][session.coll]
+    cancelled = asyncio.Event()
+    await start_background_job(session, tail_to_chat(client, chat_id, collection, tail, cancelled), cancelled, slots=tail_slots)
 
-@app.on_callback_query(filters.regex("^insert:"))
-async def insert_prompt(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
-    user_sessions[callback_query.from_user.id].update({"db": db_name, "coll": coll_name, "state": "awaiting_insert"})
+@callbacks.route("insert")
+@instrument_handler
+async def insert_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_insert")
     await callback_query.edit_message_text(
         f"Please enter the document to insert into {db_name}.{coll_name} in JSON format.\n"
-        "Example: {\"name\": \"John\", \"age\": 30}"
+        "Example: {\"name\": \"John\", \"age\": 30}\n"
+        "To insert many documents, upload a JSON or JSONL file instead."
+    )
+
+@callbacks.route("import")
+@instrument_handler
+async def import_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_import")
+    await callback_query.edit_message_text(
+        f"Please upload a file of documents to import into {db_name}.{coll_name}.\n"
+        "Accepted: a JSON array, JSONL, or either one gzipped (.gz). Extended JSON such as {\"$oid\": ...} is supported."
     )
 
-@app.on_callback_query(filters.regex("^update:"))
-async def update_prompt(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
-    user_sessions[callback_query.from_user.id].update({"db": db_name, "coll": coll_name, "state": "awaiting_update_filter"})
+@callbacks.route("update")
+@instrument_handler
+async def update_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_update_filter")
     await callback_query.edit_message_text(
         f"Please enter the filter to select the document to update in {db_name}.{coll_name} in JSON format.\n"
         "Example: {\"name\": \"John\"}"
     )
 
-@app.on_callback_query(filters.regex("^delete:"))
-async def delete_prompt(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
-    user_sessions[callback_query.from_user.id].update({"db": db_name, "coll": coll_name, "state": "awaiting_delete"})
+@callbacks.route("delete")
+@instrument_handler
+async def delete_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_delete")
     await callback_query.edit_message_text(
         f"Please enter the filter to select the document to delete from {db_name}.{coll_name} in JSON format.\n"
         "Example: {\"name\": \"John\"}"
     )
 
-@app.on_callback_query(filters.regex("^delete_all:"))
-async def confirm_delete_all(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
+@callbacks.route("update_many")
+@instrument_handler
+async def update_many_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_update_many_filter")
+    await callback_query.edit_message_text(
+        f"Please enter the filter selecting the documents to update in {db_name}.{coll_name} in JSON format.\n"
+        "Example: {\"status\": \"expired\"}\n"
+        "You will see how many documents match before anything is changed."
+    )
+
+@callbacks.route("delete_many")
+@instrument_handler
+async def delete_many_prompt(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, db=db_name, coll=coll_name, state="awaiting_delete_many")
+    await callback_query.edit_message_text(
+        f"Please enter the filter selecting the documents to delete from {db_name}.{coll_name} in JSON format.\n"
+        "Example: {\"status\": \"expired\"}\n"
+        "You will see how many documents match before anything is deleted."
+    )
+
+def format_bulk_result(action, result):
+    if action == "update":
+        return f"Matched {result['matched']}, modified {result['modified']} document(s) in {result['batches']} batch(es)."
+    return f"Deleted {result['deleted']} document(s) in {result['batches']} batch(es)."
+
+async def bulk_to_chat(client, chat_id, session, collection, action, query, update, cancelled):
+    name = f"{collection.database.name}.{collection.name}"
+    cancel_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data="cancel_job")]])
+    status = await outbox.send_message(client, chat_id, f"Running {action} on {name}...", reply_markup=cancel_keyboard)
+
+    async def progress(result):
+        await outbox.edit_message_text(
+            client, chat_id, status.id, f"Running {action} on {name}...\n{format_bulk_result(action, result)}",
+            reply_markup=cancel_keyboard
+        )
+
+    try:
+        result = await run_in_batches(collection, query, update, progress=progress, cancelled=cancelled)
+        text = f"Finished {action} on {name}. {format_bulk_result(action, result)}"
+    except BulkCancelled as e:
+        text = f"Cancelled {action} on {name}. {format_bulk_result(action, e.args[0])}"
+    except Exception as e:
+        text = f"{action.capitalize()} on {name} failed: {str(e)}"
+    invalidate_collection_caches(session, collection.database.name, collection.name)
+    await outbox.edit_message_text(client, chat_id, status.id, text)
+
+@callbacks.route("confirm_bulk")
+@instrument_handler
+async def confirm_bulk(client, callback_query: CallbackQuery, db_name, coll_name):
+    user_id = callback_query.from_user.id
+    if user_id in background_jobs:
+        await callback_query.answer("Another long-running operation is already in progress.", show_alert=True)
+        return
+    session = await get_session(user_id)
+    if session.bulk_action is None:
+        await callback_query.answer("Nothing to confirm.")
+        return
+    if (session.bulk_db, session.bulk_coll) != (db_name, coll_name):
+        # A newer preview for another collection replaced the one this button belongs to
+        await callback_query.answer("This confirmation is out of date. Please start the operation again.", show_alert=True)
+        return
+    collection = session.mongo_client[db_name][coll_name]
+    action, query, update = session.bulk_action, session.bulk_filter, session.bulk_update
+    cancelled = asyncio.Event()
+    await start_background_job(
+        session,
+        bulk_to_chat(client, callback_query.message.chat.id, session, collection, action, query, update, cancelled),
+        cancelled
+    )
+    index_advisor.record(session.mongo_handle.key, db_name, coll_name, query)
+    user_sessions.update(session, bulk_action=None, bulk_filter=None, bulk_update=None, bulk_db=None, bulk_coll=None)
+    await callback_query.edit_message_text(f"Started {action} on {db_name}.{coll_name}.")
+
+@callbacks.route("delete_all")
+@instrument_handler
+async def confirm_delete_all(client, callback_query: CallbackQuery, db_name, coll_name):
     keyboard = InlineKeyboardMarkup([
-        [InlineKeyboardButton("Yes, delete all", callback_data=f"execute_delete_all:{db_name}:{coll_name}")],
-        [InlineKeyboardButton("No, cancel", callback_data=f"coll:{db_name}:{coll_name}")]
+        [InlineKeyboardButton("Yes, delete all", callback_data=callbacks.data("execute_delete_all", db_name, coll_name))],
+        [InlineKeyboardButton("No, cancel", callback_data=callbacks.data("coll", db_name, coll_name))]
     ])
     await callback_query.edit_message_text(
         f"Are you sure you want to delete all documents from {db_name}.{coll_name}? This action cannot be undone.",
         reply_markup=keyboard
     )
 
-@app.on_callback_query(filters.regex("^execute_delete_all:"))
-async def execute_delete_all(client, callback_query: CallbackQuery):
-    _, db_name, coll_name = callback_query.data.split(":")
-    mongo_client = user_sessions[callback_query.from_user.id]["mongo_client"]
+@callbacks.route("execute_delete_all")
+@instrument_handler
+async def execute_delete_all(client, callback_query: CallbackQuery, db_name, coll_name):
+    session = await get_session(callback_query.from_user.id)
+    mongo_client = session.mongo_client
     deleted_count = await delete_all_documents(mongo_client, db_name, coll_name)
+    invalidate_collection_caches(session, db_name, coll_name)
     await callback_query.edit_message_text(f"Deleted {deleted_count} documents from {db_name}.{coll_name}.")
 
-@app.on_callback_query(filters.regex("^main_menu$"))
+@callbacks.route("export_menu")
+@instrument_handler
+async def export_menu(client, callback_query: CallbackQuery, db_name, coll_name):
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("JSONL (gzip)", callback_data=callbacks.data("export", db_name, coll_name, "jsonl"))],
+        [InlineKeyboardButton("CSV (gzip)", callback_data=callbacks.data("export", db_name, coll_name, "csv"))],
+        [InlineKeyboardButton("Back to Collection Options", callback_data=callbacks.data("coll", db_name, coll_name))]
+    ])
+    await callback_query.edit_message_text(f"Export {db_name}.{coll_name} as:", reply_markup=keyboard)
+
+async def run_background_job(user_id, slots, handle, job):
+    try:
+        await job
+    finally:
+        slots.release(handle.key)
+        handle.release()
+        background_jobs.pop(user_id, None)
+
+async def start_background_job(session, job, cancelled, slots=job_slots):
+    # The job holds a registry reference of its own, so the client isn't evicted under it
+    # when the session lets go of its handle before the job finishes
+    handle = await client_registry.acquire(session.mongo_url)
+    try:
+        await slots.acquire(handle.key)
+    except Busy:
+        handle.release()
+        job.close()
+        raise
+    background_jobs[session.user_id] = (
+        cancelled, asyncio.ensure_future(run_background_job(session.user_id, slots, handle, job))
+    )
+
+async def export_to_chat(client, chat_id, collection, fmt, query, projection, cancelled):
+    name = f"{collection.database.name}.{collection.name}"
+    cancel_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data="cancel_job")]])
+    status = await outbox.send_message(client, chat_id, f"Exporting {name} as {fmt}...", reply_markup=cancel_keyboard)
+
+    async def progress(rows, size):
+        await outbox.edit_message_text(
+            client, chat_id, status.id,
+            f"Exporting {name} as {fmt}...\n{rows} documents, {humanize.naturalsize(size)} so far",
+            reply_markup=cancel_keyboard
+        )
+
+    try:
+        result = await export_collection(
+            collection, fmt, query=query, projection=projection, progress=progress, cancelled=cancelled
+        )
+    except ExportCancelled:
+        await outbox.edit_message_text(client, chat_id, status.id, f"Export of {name} cancelled.")
+        return
+    except Exception as e:
+        await outbox.edit_message_text(client, chat_id, status.id, f"Export of {name} failed: {str(e)}")
+        return
+    try:
+        summary = f"{name}: {result['rows']} documents, {humanize.naturalsize(result['bytes'])}"
+        if result["limit"]:
+            summary += f" (stopped at the {result['limit']} cap)"
+        await outbox.edit_message_text(client, chat_id, status.id, f"Uploading {summary}...")
+        await outbox.call(
+            chat_id, client.send_document, chat_id, result["path"],
+            file_name=f"{name}.{fmt}.gz", caption=summary
+        )
+        await outbox.edit_message_text(client, chat_id, status.id, f"Export complete. {summary}")
+    finally:
+        os.remove(result["path"])
+
+@callbacks.route("export")
+@instrument_handler
+async def start_export(client, callback_query: CallbackQuery, db_name, coll_name, fmt, search_spec=None):
+    # Search result buttons carry the search they were shown for, not the user's latest one
+    user_id = callback_query.from_user.id
+    if user_id in background_jobs:
+        await callback_query.answer("Another long-running operation is already in progress.", show_alert=True)
+        return
+    session = await get_session(user_id)
+    query = projection = None
+    if search_spec is not None:
+        search = parse_search(search_spec)
+        query, projection = search["filter"], search["projection"]
+    collection = session.mongo_client[db_name][coll_name]
+    cancelled = asyncio.Event()
+    await start_background_job(
+        session,
+        export_to_chat(client, callback_query.message.chat.id, collection, fmt, query, projection, cancelled),
+        cancelled
+    )
+    await callback_query.answer("Export started")
+
+async def import_to_chat(client, message, session, collection, cancelled):
+    chat_id = message.chat.id
+    name = f"{collection.database.name}.{collection.name}"
+    file_name = message.document.file_name or "upload.json"
+    cancel_keyboard = InlineKeyboardMarkup([[InlineKeyboardButton("Cancel", callback_data="cancel_job")]])
+    status = await outbox.send_message(client, chat_id, f"Downloading {file_name}...", reply_markup=cancel_keyboard)
+
+    async def progress(summary):
+        await outbox.edit_message_text(
+            client, chat_id, status.id, f"Importing {file_name} into {name}...\n{format_summary(summary)}",
+            reply_markup=cancel_keyboard
+        )
+
+    fd, path = tempfile.mkstemp(prefix="import-")
+    os.close(fd)
+    try:
+        await client.download_media(message, file_name=path)
+        summary = await import_file(
+            collection, path, compressed=file_name.endswith(".gz"), progress=progress, cancelled=cancelled
+        )
+    except Exception as e:
+        await outbox.edit_message_text(client, chat_id, status.id, f"Import of {file_name} failed: {str(e)}")
+        return
+    finally:
+        os.remove(path)
+    invalidate_collection_caches(session, collection.database.name, collection.name)
+    title = "Import cancelled" if summary["cancelled"] else "Import complete"
+    await outbox.edit_message_text(client, chat_id, status.id, f"{title} for {name}.\n{format_summary(summary)}")
+
+@app.on_message(filters.document)
+@instrument_handler
+@user_queue.serialized
+async def handle_document(client, message: Message):
+    user_id = message.from_user.id
+    session = await get_session(user_id)
+    if session is None or session.state not in ("awaiting_insert", "awaiting_import"):
+        await message.reply_text("To import a file, choose Import File in a collection's options first.")
+        return
+    if user_id in background_jobs:
+        await message.reply_text("Another long-running operation is already in progress.")
+        return
+    collection = session.mongo_client[session.db][session.coll]
+    cancelled = asyncio.Event()
+    await start_background_job(session, import_to_chat(client, message, session, collection, cancelled), cancelled)
+    user_sessions.update(session, state="main_menu")
+
+@callbacks.route("cancel_job")
+@instrument_handler
+async def cancel_job(client, callback_query: CallbackQuery):
+    job = background_jobs.get(callback_query.from_user.id)
+    if job is None:
+        await callback_query.answer("Nothing is running.")
+        return
+    job[0].set()
+    await callback_query.answer("Cancelling...")
+
+def format_index(position, index):
+    key = ", ".join(f"{field}: {kind}" for field, kind in index["key"])
+    line = f"{position}. {index['name']} {{{key}}}"
+    options = index["options"]
+    flags = [flag for flag in ("unique", "sparse", "hidden") if options.get(flag)]
+    if "expireAfterSeconds" in options:
+        flags.append(f"TTL {options['expireAfterSeconds']}s")
+    if "partialFilterExpression" in options:
+        flags.append(f"partial {json.dumps(options['partialFilterExpression'], default=str)}")
+    if flags:
+        line += f" [{', '.join(flags)}]"
+    details = []
+    if index["size"] is not None:
+        details.append(humanize.naturalsize(index["size"]))
+    if index["usage"] is not None:
+        details.append(f"used {index['usage']['ops']} times")
+    if details:
+        line += " - " + ", ".join(details)
+    return line
+
+@callbacks.route("indexes_menu")
+@instrument_handler
+async def indexes_menu(client, callback_query: CallbackQuery):
+    session = await get_session(callback_query.from_user.id)
+    indexes = await list_indexes(session.mongo_client[session.db][session.coll])
+    lines = [f"Indexes on {session.db}.{session.coll}:", ""]
+    lines += [format_index(i + 1, index) for i, index in enumerate(indexes)]
+    if indexes and indexes[0]["usage"] is None:
+        lines += ["", "Usage counts are unavailable ($indexStats is not permitted for this user)."]
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Create Index", callback_data="create_index")],
+        [InlineKeyboardButton("Suggest Indexes", callback_data="suggest_indexes")],
+        [InlineKeyboardButton("Drop Index", callback_data="drop_index_menu")],
+        [InlineKeyboardButton("Back to Collection Options", callback_data=callbacks.data("coll", session.db, session.coll))]
+    ])
+    await callback_query.edit_message_text("\n".join(lines)[:4096], reply_markup=keyboard)
+
+@callbacks.route("create_index")
+@instrument_handler
+async def create_index_prompt(client, callback_query: CallbackQuery):
+    session = await get_session(callback_query.from_user.id)
+    user_sessions.update(session, state="awaiting_index_spec")
+    await callback_query.edit_message_text(
+        f"Please enter the index to create on {session.db}.{session.coll} in JSON format.\n"
+        "Examples:\n"
+        "{\"email\": 1}\n"
+        "{\"keys\": {\"user_id\": 1, \"created_at\": -1}, \"unique\": true}\n"
+        "{\"keys\": {\"created_at\": 1}, \"expireAfterSeconds\": 86400}\n"
+        "{\"keys\": {\"status\": 1}, \"partialFilterExpression\": {\"status\": \"active\"}}"
+    )
+
+async def index_build_to_chat(client, chat_id, session, collection, keys, options):
+    name = f"{collection.database.name}.{collection.name}"
+    key = ", ".join(f"{field}: {kind}" for field, kind in keys)
+    status = await outbox.send_message(client, chat_id, f"Building index {{{key}}} on {name}...")
+
+    async def progress(state):
+        text = f"Building index {{{key}}} on {name}..."
+        if state is not None:
+            done, total, message = state
+            text += f"\n{message or 'Progress'}: {done}/{total}"
+        await outbox.edit_message_text(client, chat_id, status.id, text)
+
+    try:
+        index_name = await build_index(collection, keys, options, progress=progress)
+    except Exception as e:
+        await outbox.edit_message_text(client, chat_id, status.id, f"Index build on {name} failed: {str(e)}")
+        return
+    invalidate_collection_caches(session, collection.database.name, collection.name)
+    await outbox.edit_message_text(client, chat_id, status.id, f"Index {index_name} created on {name}.")
+
+async def start_index_build(client, chat_id, session, db_name, coll_name, keys, options):
+    if session.user_id in background_jobs:
+        await outbox.send_message(client, chat_id, "Another long-running operation is already in progress.")
+        return
+    collection = session.mongo_client[db_name][coll_name]
+    # Index builds can't be cancelled from here; the event only satisfies the job registry
+    await start_background_job(
+        session, index_build_to_chat(client, chat_id, session, collection, keys, options), asyncio.Event()
+    )
+
+async def current_suggestions(session):
+    indexes = await list_indexes(session.mongo_client[session.db][session.coll])
+    existing = [index["key"] for index in indexes]
+    return index_advisor.suggest(session.mongo_handle.key, session.db, session.coll, existing)
+
+@callbacks.route("suggest_indexes")
+@instrument_handler
+async def suggest_indexes(client, callback_query: CallbackQuery):
+    session = await get_session(callback_query.from_user.id)
+    suggestions = await current_suggestions(session)
+    back = [InlineKeyboardButton("Back to Indexes", callback_data="indexes_menu")]
+    if not suggestions:
+        await callback_query.edit_message_text(
+            f"No index suggestions for {session.db}.{session.coll}. Suggestions come from recent searches, "
+            "updates and deletes that no existing index serves.",
+            reply_markup=InlineKeyboardMarkup([back])
+        )
+        return
+    lines = [f"Suggested indexes for {session.db}.{session.coll}:", ""]
+    keyboard = []
+    for i, suggestion in enumerate(suggestions):
+        key = ", ".join(f"{field}: {kind}" for field, kind in suggestion["keys"])
+        lines.append(f"{i + 1}. {{{key}}} - would serve {suggestion['queries']} recent queries")
+        keys = tuple(tuple(pair) for pair in suggestion["keys"])
+        keyboard.append([InlineKeyboardButton(
+            f"Create #{i + 1}", callback_data=callbacks.data("create_suggested", session.db, session.coll, keys)
+        )])
+    keyboard.append(back)
+    await callback_query.edit_message_text("\n".join(lines), reply_markup=InlineKeyboardMarkup(keyboard))
+
+@callbacks.route("create_suggested")
+@instrument_handler
+async def create_suggested_index(client, callback_query: CallbackQuery, db_name, coll_name, keys):
+    # The button carries the exact index it offered, so a later suggestion list or another
+    # open collection can't change what gets built
+    session = await get_session(callback_query.from_user.id)
+    await start_index_build(client, callback_query.message.chat.id, session, db_name, coll_name, [tuple(pair) for pair in keys], {})
+    await callback_query.answer("Index build started")
+
+@callbacks.route("drop_index_menu")
+@instrument_handler
+async def drop_index_menu(client, callback_query: CallbackQuery):
+    session = await get_session(callback_query.from_user.id)
+    indexes = await list_indexes(session.mongo_client[session.db][session.coll])
+    keyboard = [
+        [InlineKeyboardButton(index["name"], callback_data=callbacks.data("drop_index", session.db, session.coll, index["name"]))]
+        for index in indexes if index["name"] != "_id_"
+    ]
+    keyboard.append([InlineKeyboardButton("Cancel", callback_data="indexes_menu")])
+    await callback_query.edit_message_text(
+        f"Select an index to drop from {session.db}.{session.coll}:", reply_markup=InlineKeyboardMarkup(keyboard)
+    )
+
+@callbacks.route("drop_index")
+@instrument_handler
+async def confirm_drop_index(client, callback_query: CallbackQuery, db_name, coll_name, name):
+    keyboard = InlineKeyboardMarkup([
+        [InlineKeyboardButton("Yes, drop index", callback_data=callbacks.data("execute_drop_index", db_name, coll_name, name))],
+        [InlineKeyboardButton("No, cancel", callback_data="indexes_menu")]
+    ])
+    await callback_query.edit_message_text(
+        f"Are you sure you want to drop the index '{name}' from {db_name}.{coll_name}?", reply_markup=keyboard
+    )
+
+@callbacks.route("execute_drop_index")
+@instrument_handler
+async def execute_drop_index(client, callback_query: CallbackQuery, db_name, coll_name, name):
+    session = await get_session(callback_query.from_user.id)
+    try:
+        await drop_index(session.mongo_client[db_name][coll_name], name)
+    except OperationFailure as e:
+        await callback_query.answer(f"Could not drop the index: {e.details.get('errmsg', str(e)) if e.details else str(e)}", show_alert=True)
+        return
+    invalidate_collection_caches(session, db_name, coll_name)
+    await callback_query.edit_message_text(
+        f"Index '{name}' has been dropped from {db_name}.{coll_name}.",
+        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton("Back to Indexes", callback_data="indexes_menu")]])
+    )
+
+@callbacks.route("main_menu")
+@instrument_handler
 async def back_to_main_menu(client, callback_query: CallbackQuery):
     keyboard = InlineKeyboardMarkup([
         [InlineKeyboardButton("Manage Databases", callback_data="manage_databases")],
@@ -426,13 +1142,43 @@ async def back_to_main_menu(client, callback_query: CallbackQuery):
 async def handle(request):
     return web.Response(text="Bot is running")
 
+async def handle_metrics(request):
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+async def check_telegram():
+    # get_me is a real round trip, so probes share one result for a while
+    now = time.monotonic()
+    if now - telegram_health["checked_at"] >= HEALTH_TELEGRAM_INTERVAL:
+        try:
+            await asyncio.wait_for(app.get_me(), HEALTH_TELEGRAM_TIMEOUT)
+            telegram_health["ok"] = True
+        except Exception:
+            telegram_health["ok"] = False
+        telegram_health["checked_at"] = now
+    return telegram_health["ok"]
+
+async def handle_healthz(request):
+    connected = bool(getattr(app, "is_connected", False))
+    telegram = connected and await check_telegram()
+    lag = loop_lag.lag
+    healthy = telegram and lag < HEALTH_MAX_LOOP_LAG
+    return web.json_response(
+        {"telegram": telegram, "event_loop_lag_seconds": lag, "healthy": healthy},
+        status=200 if healthy else 503
+    )
+
 async def web_server():
     web_app = web.Application()
     web_app.router.add_get("/", handle)
+    web_app.router.add_get("/metrics", handle_metrics)
+    web_app.router.add_get("/healthz", handle_healthz)
     return web_app
 
 async def main():
     await app.start()
+    client_registry.start()
+    user_sessions.start()
+    loop_lag.start()
 
     # Start web server
     port = int(os.environ.get("PORT", 8080))
@@ -451,4 +1197,6 @@ if __name__ == "__main__":
         loop.run_until_complete(main())
     except KeyboardInterrupt:
         loop.run_until_complete(app.stop())
+        user_sessions.close()
+        client_registry.close_all()
         loop.close()
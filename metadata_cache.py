@@ -0,0 +1,68 @@
+import asyncio
+import os
+import time
+
+from pymongo.errors import PyMongoError
+
+METADATA_CACHE_TTL = int(os.environ.get("METADATA_CACHE_TTL", 30))
+METADATA_CACHE_MAX_AGE = int(os.environ.get("METADATA_CACHE_MAX_AGE", 600))
+METADATA_CACHE_MAX_ENTRIES = int(os.environ.get("METADATA_CACHE_MAX_ENTRIES", 4096))
+
+
+class MetadataCache:
+    # Entries older than ttl are served while a background refresh runs; entries older
+    # than max_age are refetched before answering. Writes made by the bot itself bump the
+    # cluster generation so in-flight refreshes can't put a pre-write listing back.
+    def __init__(self, ttl=METADATA_CACHE_TTL, max_age=METADATA_CACHE_MAX_AGE,
+                 max_entries=METADATA_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._entries = {}
+        self._generations = {}
+        self._refreshing = {}
+
+    async def database_names(self, cluster_key, mongo_client):
+        return await self._get((cluster_key, None), mongo_client.list_database_names)
+
+    async def collection_names(self, cluster_key, mongo_client, db_name):
+        return await self._get((cluster_key, db_name), mongo_client[db_name].list_collection_names)
+
+    async def _get(self, key, fetch):
+        entry = self._entries.get(key)
+        if entry is not None:
+            age = time.monotonic() - entry[1]
+            if age < self.ttl:
+                return entry[0]
+            if age < self.max_age:
+                if key not in self._refreshing:
+                    self._refreshing[key] = asyncio.ensure_future(self._refresh_in_background(key, fetch))
+                return entry[0]
+        return await self._refresh(key, fetch)
+
+    async def _refresh(self, key, fetch):
+        generation = self._generations.get(key[0], 0)
+        names = await fetch()
+        if self._generations.get(key[0], 0) == generation:
+            self._entries.pop(key, None)
+            self._entries[key] = (names, time.monotonic())
+            while len(self._entries) > self.max_entries:
+                self._entries.pop(next(iter(self._entries)))
+        return names
+
+    async def _refresh_in_background(self, key, fetch):
+        try:
+            await self._refresh(key, fetch)
+        except PyMongoError:
+            pass
+        finally:
+            self._refreshing.pop(key, None)
+
+    def invalidate(self, cluster_key, db_name=None):
+        self._generations[cluster_key] = self._generations.get(cluster_key, 0) + 1
+        self._entries.pop((cluster_key, None), None)
+        if db_name is None:
+            for key in [key for key in self._entries if key[0] == cluster_key]:
+                del self._entries[key]
+        else:
+            self._entries.pop((cluster_key, db_name), None)
@@ -0,0 +1,187 @@
+import asyncio
+import functools
+import threading
+import time
+
+from pymongo import monitoring
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+_registry = []
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _labels(pairs):
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Mongo command events arrive on driver threads, so updates take a lock
+        self._lock = threading.Lock()
+        self._values = {}
+        _registry.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def collect(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = list(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(list(zip(self.labelnames, key)), value))
+        return lines
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labelnames=()):
+        super().__init__(name + "_total", documentation, labelnames)
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, pairs, value):
+        return [f"{self.name}{_labels(pairs)} {value}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # One slot per bucket, then the running sum and count
+                state = self._values[key] = [0] * (len(self.buckets) + 2)
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[i] += 1
+            state[-2] += value
+            state[-1] += 1
+
+    def _samples(self, pairs, state):
+        samples = [
+            f"{self.name}_bucket{_labels(pairs + [('le', bound)])} {state[i]}"
+            for i, bound in enumerate(self.buckets)
+        ]
+        samples.append(f"{self.name}_bucket{_labels(pairs + [('le', '+Inf')])} {state[-1]}")
+        samples.append(f"{self.name}_sum{_labels(pairs)} {state[-2]}")
+        samples.append(f"{self.name}_count{_labels(pairs)} {state[-1]}")
+        return samples
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, function):
+        super().__init__(name, documentation)
+        self.function = function
+
+    def collect(self):
+        return [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} gauge",
+            f"{self.name} {self.function()}",
+        ]
+
+
+def render():
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.collect())
+    return "\n".join(lines) + "\n"
+
+
+HANDLER_SECONDS = Histogram("bot_handler_seconds", "Time spent in Telegram update handlers.", ["handler"])
+HANDLER_ERRORS = Counter("bot_handler_errors", "Exceptions raised by Telegram update handlers.", ["handler"])
+MONGO_HELPER_SECONDS = Histogram("bot_mongo_helper_seconds", "Time spent in Mongo helper functions.", ["helper"])
+MONGO_HELPER_ERRORS = Counter("bot_mongo_helper_errors", "Exceptions raised by Mongo helper functions.", ["helper"])
+MONGO_COMMAND_SECONDS = Histogram("bot_mongo_command_seconds", "Latency of MongoDB commands sent by the driver.", ["command"])
+MONGO_COMMAND_ERRORS = Counter("bot_mongo_command_errors", "MongoDB commands that failed.", ["command"])
+RENDERED_BYTES = Counter("bot_rendered_bytes", "UTF-8 bytes of document text rendered for display.")
+TELEGRAM_MESSAGES = Counter("bot_telegram_messages", "Telegram API calls made to deliver output.", ["method"])
+TELEGRAM_FLOOD_WAITS = Counter("bot_telegram_flood_waits", "FloodWait errors returned by Telegram.")
+BUSY_REJECTIONS = Counter("bot_busy_rejections", "Updates answered with busy instead of being run.", ["kind"])
+DUPLICATE_TAPS = Counter("bot_duplicate_taps", "Repeated button taps dropped while the first was pending.")
+
+
+def instrument_handler(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=name)
+            raise
+        finally:
+            HANDLER_SECONDS.observe(time.perf_counter() - start, handler=name)
+    return wrapper
+
+
+def instrument_helper(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await func(*args, **kwargs)
+        except Exception:
+            MONGO_HELPER_ERRORS.inc(helper=name)
+            raise
+        finally:
+            MONGO_HELPER_SECONDS.observe(time.perf_counter() - start, helper=name)
+    return wrapper
+
+
+class CommandMetrics(monitoring.CommandListener):
+    # Covers every operation the driver runs, including ones outside the helpers
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+
+    def failed(self, event):
+        MONGO_COMMAND_SECONDS.observe(event.duration_micros / 1e6, command=event.command_name)
+        MONGO_COMMAND_ERRORS.inc(command=event.command_name)
+
+
+class LoopLagMonitor:
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.lag = 0.0
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, time.monotonic() - start - self.interval)
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.ensure_future(self._run())
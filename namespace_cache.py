@@ -0,0 +1,65 @@
+import asyncio
+import time
+
+
+class NamespaceCache:
+    # Values per (cluster_key, db_name, coll_name), kept for ttl seconds. At most
+    # max_entries are held; the least recently stored go first.
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}
+        self._locks = {}
+
+    @staticmethod
+    def key(cluster_key, collection):
+        return (cluster_key, collection.database.name, collection.name)
+
+    def entry(self, key):
+        # (value, stored_at) whatever its age, or None
+        return self._entries.get(key)
+
+    def fresh(self, key):
+        entry = self._entries.get(key)
+        if entry and time.monotonic() - entry[1] < self.ttl:
+            return entry[0]
+        return None
+
+    def store(self, key, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (value, time.monotonic())
+        while len(self._entries) > self.max_entries:
+            self._entries.pop(next(iter(self._entries)))
+        return value
+
+    async def get_or_compute(self, key, compute, refresh=False):
+        # compute() runs at most once at a time per key; taps that queue behind it reuse
+        # its result, even when they asked for a refresh
+        if not refresh:
+            value = self.fresh(key)
+            if value is not None:
+                return value
+        lock = self._locks.setdefault(key, asyncio.Lock())
+        async with lock:
+            entry = self._entries.get(key)
+            if entry and time.monotonic() - entry[1] < (1 if refresh else self.ttl):
+                value = entry[0]
+            else:
+                value = self.store(key, await compute())
+        if not lock.locked():
+            self._locks.pop(key, None)
+        return value
+
+    def age(self, key):
+        entry = self._entries.get(key)
+        return time.monotonic() - entry[1] if entry else 0.0
+
+    def invalidate(self, cluster_key, db_name=None, coll_name=None):
+        for key in list(self._entries):
+            if key[0] != cluster_key:
+                continue
+            if db_name is not None and key[1] != db_name:
+                continue
+            if coll_name is not None and key[2] != coll_name:
+                continue
+            del self._entries[key]
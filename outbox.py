@@ -0,0 +1,184 @@
+import asyncio
+import io
+import os
+import time
+from collections import OrderedDict
+
+from pyrogram.errors import FloodWait, MessageNotModified
+
+from metrics import TELEGRAM_FLOOD_WAITS, TELEGRAM_MESSAGES
+
+MESSAGE_LIMIT = 4096
+CAPTION_LIMIT = 1024
+
+OUTBOX_GLOBAL_RATE = float(os.environ.get("OUTBOX_GLOBAL_RATE", 25))
+OUTBOX_GLOBAL_BURST = float(os.environ.get("OUTBOX_GLOBAL_BURST", 30))
+OUTBOX_CHAT_RATE = float(os.environ.get("OUTBOX_CHAT_RATE", 1))
+OUTBOX_CHAT_BURST = float(os.environ.get("OUTBOX_CHAT_BURST", 3))
+OUTBOX_MAX_CHUNKS = int(os.environ.get("OUTBOX_MAX_CHUNKS", 3))
+OUTBOX_FILE_THRESHOLD = int(os.environ.get("OUTBOX_FILE_THRESHOLD", 3 * MESSAGE_LIMIT))
+OUTBOX_MAX_RETRIES = int(os.environ.get("OUTBOX_MAX_RETRIES", 3))
+OUTBOX_MAX_CHATS = int(os.environ.get("OUTBOX_MAX_CHATS", 10000))
+
+
+class TokenBucket:
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        # Reserves a token and returns how long the caller has to wait for it; tokens may
+        # go negative so concurrent callers queue up behind each other in arrival order.
+        self._refill()
+        self.tokens -= 1
+        return max(0.0, -self.tokens / self.rate)
+
+    def pause(self, seconds):
+        self._refill()
+        self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+    def idle(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+
+def flood_wait_seconds(error):
+    # Pyrogram 2 exposes the wait as .value, 1.x as .x
+    return getattr(error, "value", None) or getattr(error, "x", None) or 1
+
+
+def split_text(text, limit=MESSAGE_LIMIT):
+    chunks = []
+    while len(text) > limit:
+        # Prefer breaking between lines so documents aren't cut mid-field
+        cut = text.rfind("\n", 0, limit)
+        if cut <= 0:
+            cut = limit
+        chunks.append(text[:cut])
+        text = text[cut:].lstrip("\n")
+    if text:
+        chunks.append(text)
+    return chunks
+
+
+class Outbox:
+    def __init__(self, global_rate=OUTBOX_GLOBAL_RATE, global_burst=OUTBOX_GLOBAL_BURST,
+                 chat_rate=OUTBOX_CHAT_RATE, chat_burst=OUTBOX_CHAT_BURST, max_chunks=OUTBOX_MAX_CHUNKS,
+                 file_threshold=OUTBOX_FILE_THRESHOLD, max_retries=OUTBOX_MAX_RETRIES, max_chats=OUTBOX_MAX_CHATS):
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_chunks = max_chunks
+        self.file_threshold = file_threshold
+        self.max_retries = max_retries
+        self.max_chats = max_chats
+        self._chat_buckets = OrderedDict()
+        self._edits = {}
+
+    def _chat_bucket(self, chat_id):
+        bucket = self._chat_buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._chat_buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            if len(self._chat_buckets) > self.max_chats:
+                # Drop buckets that have fully refilled; they carry no state worth keeping
+                for other_id, other in list(self._chat_buckets.items()):
+                    if len(self._chat_buckets) <= self.max_chats:
+                        break
+                    if other_id != chat_id and other.idle():
+                        del self._chat_buckets[other_id]
+        else:
+            self._chat_buckets.move_to_end(chat_id)
+        return bucket
+
+    async def _acquire(self, chat_id):
+        wait = max(self.global_bucket.take(), self._chat_bucket(chat_id).take())
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def call(self, chat_id, method, *args, **kwargs):
+        return await self._call(chat_id, method, args, kwargs)
+
+    async def _call(self, chat_id, method, args, kwargs, reserved=False):
+        attempt = 0
+        while True:
+            if not reserved:
+                await self._acquire(chat_id)
+            reserved = False
+            try:
+                result = await method(*args, **kwargs)
+                TELEGRAM_MESSAGES.inc(method=method.__name__)
+                return result
+            except FloodWait as e:
+                TELEGRAM_FLOOD_WAITS.inc()
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                # Hold back everything else queued for this chat until Telegram lets us in again
+                self._chat_bucket(chat_id).pause(flood_wait_seconds(e))
+
+    async def send_message(self, client, chat_id, text, **kwargs):
+        return await self.call(chat_id, client.send_message, chat_id, text, **kwargs)
+
+    async def send_document(self, client, chat_id, data, file_name, caption="", **kwargs):
+        document = io.BytesIO(data)
+        document.name = file_name
+        return await self.call(
+            chat_id, client.send_document, chat_id, document,
+            file_name=file_name, caption=caption[:CAPTION_LIMIT], **kwargs
+        )
+
+    async def send_text(self, client, chat_id, text, reply_markup=None, file_name="output.txt"):
+        chunks = split_text(text)
+        if len(text) > self.file_threshold or len(chunks) > self.max_chunks:
+            caption = text.split("\n", 1)[0]
+            return [await self.send_document(
+                client, chat_id, text.encode(), file_name, caption=caption, reply_markup=reply_markup
+            )]
+        sent = []
+        for i, chunk in enumerate(chunks):
+            markup = reply_markup if i == len(chunks) - 1 else None
+            sent.append(await self.send_message(client, chat_id, chunk, reply_markup=markup))
+        return sent
+
+    async def edit_message_text(self, client, chat_id, message_id, text, reply_markup=None):
+        # Edits queued for the same message collapse into one request carrying the newest text
+        key = (chat_id, message_id)
+        pending = self._edits.get(key)
+        if pending is not None:
+            pending["text"] = text
+            pending["reply_markup"] = reply_markup
+            return await asyncio.shield(pending["future"])
+        future = asyncio.get_event_loop().create_future()
+        pending = self._edits[key] = {"text": text, "reply_markup": reply_markup, "future": future}
+        try:
+            await self._acquire(chat_id)
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        finally:
+            del self._edits[key]
+        try:
+            result = await self._call(
+                chat_id, client.edit_message_text, (chat_id, message_id, pending["text"]),
+                {"reply_markup": pending["reply_markup"]}, reserved=True
+            )
+        except MessageNotModified:
+            result = None
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # Coalesced callers may not exist to retrieve it
+            raise
+        future.set_result(result)
+        return result
@@ -0,0 +1,94 @@
+import asyncio
+import datetime
+import os
+import re
+import time
+
+import bson
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.objectid import ObjectId
+from pymongo.errors import PyMongoError
+
+from namespace_cache import NamespaceCache
+
+PAGE_SIZE = 5
+COUNT_CACHE_TTL = int(os.environ.get("COUNT_CACHE_TTL", 60))
+COUNT_CACHE_MAX_ENTRIES = int(os.environ.get("COUNT_CACHE_MAX_ENTRIES", 4096))
+
+# $type aliases in the order MongoDB sorts values of different types
+BSON_SORT_ORDER = ("minKey", "null", "number", "string", "object", "array", "binData", "objectId",
+                   "bool", "date", "timestamp", "regex", "maxKey")
+BSON_TYPES = (
+    (MinKey, "minKey"), (bool, "bool"), (int, "number"), (float, "number"), (bson.Decimal128, "number"),
+    (str, "string"), (dict, "object"), (list, "array"), (bytes, "binData"), (ObjectId, "objectId"),
+    (datetime.datetime, "date"), (bson.Timestamp, "timestamp"), (bson.Regex, "regex"), (re.Pattern, "regex"),
+    (MaxKey, "maxKey"),
+)
+
+
+def bson_sort_type(value):
+    if value is None:
+        return "null"
+    for kind, name in BSON_TYPES:
+        if isinstance(value, kind):
+            return name
+    return None
+
+
+def keyset_filter(key, value, operator):
+    # $gt/$lt only match values of the same type, so on a mixed-type key the walk would
+    # stop at the first type boundary; values of the types sorting beyond it are added
+    kind = bson_sort_type(value)
+    if kind is None:
+        return {key: {operator: value}}
+    position = BSON_SORT_ORDER.index(kind)
+    beyond = BSON_SORT_ORDER[position + 1:] if operator in ("$gt", "$gte") else BSON_SORT_ORDER[:position]
+    if not beyond:
+        return {key: {operator: value}}
+    return {"$or": [{key: {operator: value}}, {key: {"$type": list(beyond)}}]}
+
+
+async def fetch_page(collection, limit=PAGE_SIZE, after=None, before=None, skip=0, key="_id"):
+    # Fetches one extra document to learn whether another page exists without counting.
+    # Returns (documents, has_more) where has_more points in the direction of travel.
+    if before is not None:
+        cursor = collection.find(keyset_filter(key, before, "$lt")).sort(key, -1).limit(limit + 1)
+        documents = await cursor.to_list(length=limit + 1)
+        has_more = len(documents) > limit
+        documents = documents[:limit]
+        documents.reverse()
+        return documents, has_more
+    query = keyset_filter(key, after, "$gt") if after is not None else {}
+    cursor = collection.find(query).sort(key, 1)
+    if skip:
+        cursor = cursor.skip(skip)
+    documents = await cursor.limit(limit + 1).to_list(length=limit + 1)
+    return documents[:limit], len(documents) > limit
+
+
+class CountCache(NamespaceCache):
+    def __init__(self, ttl=COUNT_CACHE_TTL, max_entries=COUNT_CACHE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+        self._refreshing = {}
+
+    async def get(self, cluster_key, collection):
+        key = self.key(cluster_key, collection)
+        entry = self.entry(key)
+        if entry is None:
+            return await self._refresh(key, collection)
+        # Serve the stale value immediately and let the next tap see the new one
+        if time.monotonic() - entry[1] >= self.ttl and key not in self._refreshing:
+            self._refreshing[key] = asyncio.ensure_future(self._refresh_in_background(key, collection))
+        return entry[0]
+
+    async def _refresh(self, key, collection):
+        return self.store(key, await collection.estimated_document_count())
+
+    async def _refresh_in_background(self, key, collection):
+        try:
+            await self._refresh(key, collection)
+        except PyMongoError:
+            pass
+        finally:
+            self._refreshing.pop(key, None)
@@ -0,0 +1,103 @@
+import os
+
+from pymongo.errors import ExecutionTimeout
+
+SEARCH_MAX_TIME_MS = int(os.environ.get("SEARCH_MAX_TIME_MS", 5000))
+SEARCH_DEFAULT_LIMIT = 5
+SEARCH_MAX_LIMIT = int(os.environ.get("SEARCH_MAX_LIMIT", 50))
+
+SEARCH_OPTIONS = {"filter", "projection", "sort", "limit"}
+
+
+def parse_search(spec):
+    # Either a bare filter, or {"filter": ..., "projection": ..., "sort": ..., "limit": ...}
+    if isinstance(spec, dict) and "filter" in spec and set(spec) <= SEARCH_OPTIONS and isinstance(spec["filter"], dict):
+        search = dict(spec)
+    else:
+        search = {"filter": spec}
+    if not isinstance(search["filter"], dict):
+        raise ValueError("The filter must be a JSON object.")
+    projection = search.get("projection")
+    if projection is not None and not isinstance(projection, dict):
+        raise ValueError("The projection must be a JSON object.")
+    sort = search.get("sort")
+    if sort is not None:
+        if not isinstance(sort, dict):
+            raise ValueError("The sort must be a JSON object such as {\"age\": -1}.")
+        sort = list(sort.items())
+    limit = search.get("limit", SEARCH_DEFAULT_LIMIT)
+    if not isinstance(limit, int) or limit < 1:
+        raise ValueError("The limit must be a positive integer.")
+    return {
+        "filter": search["filter"],
+        "projection": projection,
+        "sort": sort,
+        "limit": min(limit, SEARCH_MAX_LIMIT),
+    }
+
+
+def plan_stages(plan, stages=None, indexes=None):
+    # Collects stage names (outermost first) and index names from any plan shape,
+    # including sharded and slot-based engine explain output
+    if stages is None:
+        stages, indexes = [], []
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan["stage"])
+        if "indexName" in plan and plan["indexName"] not in indexes:
+            indexes.append(plan["indexName"])
+        for key, value in plan.items():
+            if key in ("inputStage", "inputStages", "queryPlan", "shards", "winningPlan", "executionStages"):
+                plan_stages(value, stages, indexes)
+    elif isinstance(plan, list):
+        for item in plan:
+            plan_stages(item, stages, indexes)
+    return stages, indexes
+
+
+async def explain(collection, search, max_time_ms=SEARCH_MAX_TIME_MS):
+    command = {"find": collection.name, "filter": search["filter"], "limit": search["limit"]}
+    if search["projection"]:
+        command["projection"] = search["projection"]
+    if search["sort"]:
+        command["sort"] = dict(search["sort"])
+    try:
+        result = await collection.database.command(
+            "explain", command, verbosity="executionStats", maxTimeMS=max_time_ms
+        )
+        timed_out = False
+    except ExecutionTimeout:
+        # Planning alone is cheap, so still show which plan the server would choose
+        result = await collection.database.command("explain", command, verbosity="queryPlanner")
+        timed_out = True
+    stages, indexes = plan_stages(result.get("queryPlanner", {}).get("winningPlan", {}))
+    stats = result.get("executionStats", {})
+    return {
+        "stages": stages,
+        "indexes": indexes,
+        "returned": stats.get("nReturned"),
+        "docs_examined": stats.get("totalDocsExamined"),
+        "keys_examined": stats.get("totalKeysExamined"),
+        "millis": stats.get("executionTimeMillis"),
+        "timed_out": timed_out,
+    }
+
+
+def format_explain(name, report, max_time_ms=SEARCH_MAX_TIME_MS):
+    lines = [f"Explain for {name}:", ""]
+    lines.append("Plan: " + (" <- ".join(report["stages"]) or "unknown"))
+    lines.append("Index used: " + (", ".join(report["indexes"]) or "none"))
+    if report["timed_out"]:
+        lines.append(f"The query did not finish within {max_time_ms} ms, so execution stats are unavailable.")
+    else:
+        lines.append(
+            f"Returned {report['returned']}, documents examined {report['docs_examined']}, "
+            f"keys examined {report['keys_examined']}, {report['millis']} ms"
+        )
+    if "COLLSCAN" in report["stages"]:
+        lines.append("")
+        lines.append("This query scans the whole collection. An index on the filtered or sorted fields would avoid that.")
+    elif report["returned"] and report["docs_examined"] and report["docs_examined"] > 10 * report["returned"]:
+        lines.append("")
+        lines.append("The index narrows the search poorly; a more selective or compound index may help.")
+    return "\n".join(lines)
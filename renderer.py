@@ -0,0 +1,260 @@
+import base64
+import calendar
+import datetime
+import json
+import math
+import os
+import re
+import uuid
+
+import humanize
+from bson.code import Code
+from bson.dbref import DBRef
+from bson.decimal128 import Decimal128
+from bson.max_key import MaxKey
+from bson.min_key import MinKey
+from bson.objectid import ObjectId
+from bson.regex import Regex
+from bson.timestamp import Timestamp
+
+from metrics import RENDERED_BYTES
+
+try:
+    from bson.datetime_ms import DatetimeMS
+except ImportError:  # pymongo < 4.3
+    DatetimeMS = None
+
+RENDER_BUDGET = int(os.environ.get("RENDER_BUDGET", 3 * 4096))
+RENDER_MAX_DEPTH = int(os.environ.get("RENDER_MAX_DEPTH", 6))
+RENDER_MAX_ITEMS = int(os.environ.get("RENDER_MAX_ITEMS", 20))
+RENDER_MAX_STRING = int(os.environ.get("RENDER_MAX_STRING", 500))
+RENDER_MAX_BINARY = int(os.environ.get("RENDER_MAX_BINARY", 48))
+
+TRUNCATED = "\n… output truncated"
+
+REGEX_FLAGS = ((re.IGNORECASE, "i"), (re.LOCALE, "l"), (re.MULTILINE, "m"),
+               (re.DOTALL, "s"), (re.UNICODE, "u"), (re.VERBOSE, "x"))
+
+
+class _BudgetExhausted(Exception):
+    pass
+
+
+def _quote(text):
+    return json.dumps(text, ensure_ascii=False)
+
+
+def projection_tree(projection):
+    # Accepts a list of dotted paths or a projection document. Leaves are True for included
+    # paths and False for excluded ones; like MongoDB, an inclusion keeps _id unless it is
+    # excluded, and other fields can't be both included and excluded.
+    if not projection:
+        return None
+    if isinstance(projection, dict):
+        included = {path for path, flag in projection.items() if flag and path != "_id"}
+        excluded = {path for path, flag in projection.items() if not flag and path != "_id"}
+        if included and excluded:
+            raise ValueError("A projection can't both include and exclude fields.")
+        if included:
+            paths = dict.fromkeys(included, True)
+            if projection.get("_id", 1):
+                paths["_id"] = True
+        else:
+            paths = {path: bool(flag) for path, flag in projection.items()}
+    else:
+        paths = dict.fromkeys(projection, True)
+    tree = {}
+    for path, flag in paths.items():
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            child = node.setdefault(part, {})
+            if not isinstance(child, dict):
+                break
+            node = child
+        else:
+            node[parts[-1]] = flag
+    return tree
+
+
+def _leaves(tree):
+    for node in tree.values():
+        if isinstance(node, dict):
+            yield from _leaves(node)
+        else:
+            yield node
+
+
+def format_datetime(value):
+    if value.tzinfo is not None:
+        value = value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    if 1970 <= value.year <= 9999:
+        text = value.strftime("%Y-%m-%dT%H:%M:%S")
+        if value.microsecond:
+            text += ".%03d" % (value.microsecond // 1000)
+        return '{"$date": "%sZ"}' % text
+    millis = calendar.timegm(value.timetuple()) * 1000 + value.microsecond // 1000
+    return '{"$date": {"$numberLong": "%d"}}' % millis
+
+
+class Renderer:
+    # Writes relaxed Extended JSON straight from BSON values, pretty printed like
+    # json.dumps(indent=2), and stops as soon as the character budget is spent.
+    def __init__(self, budget=RENDER_BUDGET, projection=None, max_depth=RENDER_MAX_DEPTH,
+                 max_items=RENDER_MAX_ITEMS, max_string=RENDER_MAX_STRING, max_binary=RENDER_MAX_BINARY):
+        self.budget = budget
+        self.tree = projection_tree(projection)
+        self.exclude = self.tree is not None and not any(_leaves(self.tree))
+        self.max_depth = max_depth
+        self.max_items = max_items
+        self.max_string = max_string
+        self.max_binary = max_binary
+        self._parts = []
+        self._size = 0
+        self._limit = budget
+
+    def _write(self, text):
+        remaining = self._limit - self._size
+        if len(text) > remaining:
+            self._parts.append(text[:remaining])
+            self._size = self._limit
+            raise _BudgetExhausted
+        self._parts.append(text)
+        self._size += len(text)
+
+    def render(self, documents, header=""):
+        # Returns (text, number of documents rendered completely)
+        self._parts = []
+        self._size = 0
+        # Leave room for the truncation marker
+        self._limit = max(0, self.budget - len(TRUNCATED))
+        rendered = 0
+        truncated = False
+        try:
+            self._write(header)
+            for document in documents:
+                self._value(document, 0, self.tree)
+                self._write("\n\n")
+                rendered += 1
+        except _BudgetExhausted:
+            truncated = True
+        text = "".join(self._parts)
+        if truncated:
+            text += TRUNCATED
+        return text, rendered
+
+    def _value(self, value, depth, tree):
+        if isinstance(value, dict):
+            self._object(value, depth, tree)
+        elif isinstance(value, (list, tuple)):
+            self._array(value, depth, tree)
+        elif isinstance(value, DBRef):
+            self._object(value.as_doc(), depth, None)
+        else:
+            self._write(self._scalar(value))
+
+    def _object(self, value, depth, tree):
+        if tree is None:
+            keys = value
+        elif self.exclude:
+            keys = [key for key in value if tree.get(key) is not False]
+        else:
+            keys = [key for key in value if key in tree]
+        if not keys:
+            self._write("{}")
+            return
+        if depth >= self.max_depth:
+            self._write(_quote(f"{{… {len(keys)} fields}}"))
+            return
+        pad = "\n" + "  " * (depth + 1)
+        self._write("{")
+        first = True
+        for key in keys:
+            self._write(("" if first else ",") + pad + _quote(str(key)) + ": ")
+            first = False
+            subtree = tree.get(key) if tree is not None else None
+            self._value(value[key], depth + 1, subtree if isinstance(subtree, dict) else None)
+        self._write("\n" + "  " * depth + "}")
+
+    def _array(self, value, depth, tree):
+        if not value:
+            self._write("[]")
+            return
+        if depth >= self.max_depth:
+            self._write(_quote(f"[… {len(value)} items]"))
+            return
+        pad = "\n" + "  " * (depth + 1)
+        self._write("[")
+        for index, item in enumerate(value[:self.max_items]):
+            self._write(("," if index else "") + pad)
+            # Projections reach through arrays the same way MongoDB applies them
+            self._value(item, depth + 1, tree)
+        hidden = len(value) - self.max_items
+        if hidden > 0:
+            self._write("," + pad + _quote(f"… {hidden} more items"))
+        self._write("\n" + "  " * depth + "]")
+
+    def _scalar(self, value):
+        if value is None:
+            return "null"
+        if isinstance(value, bool):
+            return "true" if value else "false"
+        if isinstance(value, int):
+            return str(int(value))
+        if isinstance(value, float):
+            if math.isnan(value):
+                return '{"$numberDouble": "NaN"}'
+            if math.isinf(value):
+                return '{"$numberDouble": "%sInfinity"}' % ("-" if value < 0 else "")
+            return json.dumps(value)
+        if isinstance(value, Code):
+            code = '{"$code": %s' % self._string(str(value))
+            if value.scope is not None:
+                code += ', "$scope": ' + json.dumps(value.scope, default=str, ensure_ascii=False)
+            return code + "}"
+        if isinstance(value, str):
+            return self._string(value)
+        if isinstance(value, ObjectId):
+            return '{"$oid": "%s"}' % value
+        if isinstance(value, datetime.datetime):
+            return format_datetime(value)
+        if DatetimeMS is not None and isinstance(value, DatetimeMS):
+            return '{"$date": {"$numberLong": "%d"}}' % int(value)
+        if isinstance(value, Decimal128):
+            return '{"$numberDecimal": "%s"}' % value
+        if isinstance(value, uuid.UUID):
+            return '{"$uuid": "%s"}' % value
+        if isinstance(value, bytes):
+            return self._binary(value, getattr(value, "subtype", 0))
+        if isinstance(value, Regex):
+            pattern = value.pattern if isinstance(value.pattern, str) else value.pattern.decode()
+            flags = value.flags
+            if not isinstance(flags, str):
+                flags = "".join(letter for flag, letter in REGEX_FLAGS if flags & flag)
+            return '{"$regularExpression": {"pattern": %s, "options": "%s"}}' % (self._string(pattern), flags)
+        if isinstance(value, Timestamp):
+            return '{"$timestamp": {"t": %d, "i": %d}}' % (value.time, value.inc)
+        if isinstance(value, MinKey):
+            return '{"$minKey": 1}'
+        if isinstance(value, MaxKey):
+            return '{"$maxKey": 1}'
+        return self._string(str(value))
+
+    def _string(self, value):
+        hidden = len(value) - self.max_string
+        if hidden > 0:
+            return _quote(value[:self.max_string] + f"… (+{hidden} chars)")
+        return _quote(value)
+
+    def _binary(self, value, subtype):
+        if len(value) > self.max_binary:
+            data = f"<{humanize.naturalsize(len(value))} elided>"
+        else:
+            data = base64.b64encode(value).decode()
+        return '{"$binary": {"base64": "%s", "subType": "%02x"}}' % (data, subtype)
+
+
+def render_documents(documents, header="", **options):
+    text = Renderer(**options).render(documents, header)[0]
+    RENDERED_BYTES.inc(len(text.encode("utf-8")))
+    return text
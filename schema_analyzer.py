@@ -0,0 +1,256 @@
+import datetime
+import hashlib
+import heapq
+import os
+import time
+from collections import Counter
+
+import bson
+import humanize
+from bson.objectid import ObjectId
+from pymongo.errors import ExecutionTimeout
+
+from namespace_cache import NamespaceCache
+
+SCHEMA_SAMPLE_SIZE = int(os.environ.get("SCHEMA_SAMPLE_SIZE", 1000))
+SCHEMA_MAX_TIME_MS = int(os.environ.get("SCHEMA_MAX_TIME_MS", 20000))
+SCHEMA_MAX_FIELDS = int(os.environ.get("SCHEMA_MAX_FIELDS", 200))
+SCHEMA_MAX_DEPTH = int(os.environ.get("SCHEMA_MAX_DEPTH", 5))
+SCHEMA_SKETCH_SIZE = int(os.environ.get("SCHEMA_SKETCH_SIZE", 256))
+SCHEMA_CACHE_TTL = int(os.environ.get("SCHEMA_CACHE_TTL", 600))
+SCHEMA_CACHE_MAX_ENTRIES = int(os.environ.get("SCHEMA_CACHE_MAX_ENTRIES", 256))
+
+HASH_SPACE = 2 ** 64
+TYPE_NAMES = (
+    (bool, "bool"), (int, "int"), (float, "double"), (str, "string"), (dict, "object"), (list, "array"),
+    (ObjectId, "objectId"), (datetime.datetime, "date"), (bytes, "binData"), (bson.Decimal128, "decimal"),
+    (bson.Binary, "binData"), (bson.Timestamp, "timestamp"), (bson.Regex, "regex"),
+)
+
+
+def type_name(value):
+    if value is None:
+        return "null"
+    if isinstance(value, bson.Int64):
+        return "long"
+    for kind, name in TYPE_NAMES:
+        if isinstance(value, kind):
+            return name
+    return type(value).__name__
+
+
+def value_size(value):
+    # Characters, bytes, elements or keys; None for values that have no meaningful length
+    if isinstance(value, (str, bytes, list, dict)):
+        return len(value)
+    return None
+
+
+class DistinctSketch:
+    # K minimum values: keeps the k smallest 64-bit hashes seen, which is exact below k
+    # distinct values and estimates (k - 1) / kth-smallest-fraction above it
+    __slots__ = ("k", "_heap", "_members")
+
+    def __init__(self, k=SCHEMA_SKETCH_SIZE):
+        self.k = k
+        self._heap = []
+        self._members = set()
+
+    def add(self, value):
+        digest = hashlib.blake2b(repr((type(value).__name__, value)).encode(), digest_size=8).digest()
+        h = int.from_bytes(digest, "big")
+        if h in self._members:
+            return
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, -h)
+            self._members.add(h)
+        elif h < -self._heap[0]:
+            self._members.discard(-heapq.heapreplace(self._heap, -h))
+            self._members.add(h)
+
+    def estimate(self):
+        if len(self._heap) < self.k:
+            return len(self._heap)
+        return int((self.k - 1) * HASH_SPACE / -self._heap[0])
+
+
+class FieldStats:
+    __slots__ = ("documents", "present", "nulls", "types", "distinct", "size_min", "size_max", "size_total", "sized")
+
+    def __init__(self):
+        # Values inside arrays can appear several times in one document
+        self.documents = 0
+        self.present = 0
+        self.nulls = 0
+        self.types = Counter()
+        self.distinct = None
+        self.size_min = None
+        self.size_max = 0
+        self.size_total = 0
+        self.sized = 0
+
+    def add(self, value):
+        self.present += 1
+        kind = type_name(value)
+        self.types[kind] += 1
+        if value is None:
+            self.nulls += 1
+        elif kind not in ("object", "array"):
+            if self.distinct is None:
+                self.distinct = DistinctSketch()
+            self.distinct.add(value)
+        size = value_size(value)
+        if size is not None:
+            self.sized += 1
+            self.size_total += size
+            self.size_max = max(self.size_max, size)
+            self.size_min = size if self.size_min is None else min(self.size_min, size)
+
+
+class SchemaProfile:
+    # Folds documents in one at a time, so memory depends on the number of fields and the
+    # sketch size, never on how many documents were sampled
+    def __init__(self, max_fields=SCHEMA_MAX_FIELDS, max_depth=SCHEMA_MAX_DEPTH):
+        self.max_fields = max_fields
+        self.max_depth = max_depth
+        self.documents = 0
+        self.bytes = 0
+        self.fields = {}
+        self.skipped_fields = 0
+
+    def add(self, document):
+        self.documents += 1
+        self.bytes += len(bson.encode(document))
+        seen = set()
+        self._add_object(document, "", 0, seen)
+        for stats in seen:
+            stats.documents += 1
+
+    def _field(self, path, seen):
+        stats = self.fields.get(path)
+        if stats is None and len(self.fields) < self.max_fields:
+            stats = self.fields[path] = FieldStats()
+        if stats is not None:
+            seen.add(stats)
+        return stats
+
+    def _add_object(self, document, prefix, depth, seen):
+        for key, value in document.items():
+            self._add_value(f"{prefix}{key}", value, depth, seen)
+
+    def _add_value(self, path, value, depth, seen):
+        stats = self._field(path, seen)
+        if stats is None:
+            self.skipped_fields += 1
+            return
+        stats.add(value)
+        if depth >= self.max_depth:
+            return
+        if isinstance(value, dict):
+            self._add_object(value, f"{path}.", depth + 1, seen)
+        elif isinstance(value, list):
+            # Element types go under "path[]"; fields of embedded documents keep the dotted
+            # path, which is how queries address them through arrays
+            for item in value:
+                if isinstance(item, dict):
+                    self._add_object(item, f"{path}.", depth + 1, seen)
+                else:
+                    items = self._field(f"{path}[]", seen)
+                    if items is None:
+                        self.skipped_fields += 1
+                        break
+                    items.add(item)
+
+    def summary(self):
+        fields = []
+        for path, stats in self.fields.items():
+            fields.append({
+                "path": path,
+                "documents": stats.documents,
+                "present": stats.present,
+                "nulls": stats.nulls,
+                "types": stats.types.most_common(),
+                "distinct": stats.distinct.estimate() if stats.distinct else None,
+                "size": (stats.size_min, stats.size_total / stats.sized, stats.size_max) if stats.sized else None,
+            })
+        return {
+            "documents": self.documents,
+            "avg_document_size": self.bytes / self.documents if self.documents else 0,
+            "fields": fields,
+            "skipped_fields": self.skipped_fields,
+        }
+
+
+async def sample_schema(collection, sample_size=SCHEMA_SAMPLE_SIZE, max_time_ms=SCHEMA_MAX_TIME_MS):
+    # $sample reads random documents through a random cursor when the sample is a small
+    # share of the collection, so the cost stays the same on huge collections. The server
+    # stops at maxTimeMS and the loop at the same wall-clock deadline; either way the
+    # documents folded in so far still make a (partial) profile.
+    profile = SchemaProfile()
+    deadline = time.monotonic() + max_time_ms / 1000
+    partial = False
+    cursor = collection.aggregate([{"$sample": {"size": sample_size}}], maxTimeMS=max_time_ms)
+    try:
+        async for document in cursor:
+            profile.add(document)
+            if time.monotonic() > deadline:
+                partial = True
+                break
+    except ExecutionTimeout:
+        partial = True
+    finally:
+        await cursor.close()
+    report = profile.summary()
+    report["estimated_count"] = await collection.estimated_document_count()
+    report["partial"] = partial
+    return report
+
+
+class SchemaCache(NamespaceCache):
+    def __init__(self, ttl=SCHEMA_CACHE_TTL, max_entries=SCHEMA_CACHE_MAX_ENTRIES):
+        super().__init__(ttl, max_entries)
+
+    def peek(self, cluster_key, db_name, coll_name):
+        return self.fresh((cluster_key, db_name, coll_name))
+
+    async def get(self, cluster_key, collection, refresh=False):
+        return await self.get_or_compute(self.key(cluster_key, collection), lambda: sample_schema(collection), refresh)
+
+
+def format_share(part, whole):
+    return f"{100 * part / whole:.0f}%" if whole else "0%"
+
+
+def format_schema(name, report, age):
+    documents = report["documents"]
+    lines = [
+        f"Schema of {name}",
+        f"Sampled {documents} of about {report['estimated_count']} documents, "
+        f"{report['avg_document_size']:.0f} bytes each on average"
+        + (" (stopped early at the time limit)" if report["partial"] else "") + ".",
+        "",
+    ]
+    for field in report["fields"]:
+        types = ", ".join(f"{kind} {format_share(count, field['present'])}" for kind, count in field["types"])
+        parts = [f"{field['path']}: {types}", f"in {format_share(field['documents'], documents)}"]
+        if field["nulls"]:
+            parts.append(f"null {format_share(field['nulls'], field['present'])}")
+        if field["distinct"] is not None:
+            parts.append(f"~{field['distinct']} distinct")
+        if field["size"]:
+            low, mean, high = field["size"]
+            parts.append(f"length {low}-{high} (avg {mean:.1f})")
+        lines.append(", ".join(parts))
+    if not report["fields"]:
+        lines.append("The collection looks empty.")
+    if report["skipped_fields"]:
+        lines.append(f"Fields beyond the first {len(report['fields'])} were not profiled.")
+    lines += ["", f"Computed {humanize.naturaldelta(age)} ago"]
+    return "\n".join(lines)
+
+
+def top_fields(report, limit=8):
+    # Most common top-level fields, for search and projection hints
+    fields = [field for field in report["fields"] if "." not in field["path"] and not field["path"].endswith("[]")]
+    fields.sort(key=lambda field: -field["documents"])
+    return [field["path"] for field in fields[:limit]]
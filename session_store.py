@@ -0,0 +1,254 @@
+import asyncio
+import os
+import sqlite3
+import time
+from collections import OrderedDict
+
+from bson.json_util import dumps, loads
+
+SESSION_BACKEND = os.environ.get("SESSION_BACKEND", "sqlite")
+SESSION_PATH = os.environ.get("SESSION_PATH", "sessions.sqlite3")
+SESSION_MAX_ACTIVE = int(os.environ.get("SESSION_MAX_ACTIVE", 1000))
+SESSION_TTL = int(os.environ.get("SESSION_TTL", 6 * 3600))
+SESSION_SWEEP_INTERVAL = int(os.environ.get("SESSION_SWEEP_INTERVAL", 60))
+SESSION_FLUSH_INTERVAL = float(os.environ.get("SESSION_FLUSH_INTERVAL", 1))
+
+
+class Session:
+    # Fields written to the backend; the Mongo handle is always re-acquired after a restore
+    PERSISTED = ("state", "mongo_url", "db", "coll", "update_filter", "search_query",
+                 "bulk_action", "bulk_filter", "bulk_update", "bulk_db", "bulk_coll")
+
+    __slots__ = PERSISTED + ("user_id", "mongo_handle", "last_seen", "saved_at")
+
+    def __init__(self, user_id, state=None, mongo_url=None, db=None, coll=None, update_filter=None,
+                 search_query=None, bulk_action=None, bulk_filter=None, bulk_update=None, bulk_db=None, bulk_coll=None):
+        self.user_id = user_id
+        self.state = state
+        self.mongo_url = mongo_url
+        self.db = db
+        self.coll = coll
+        self.update_filter = update_filter
+        self.search_query = search_query
+        self.bulk_action = bulk_action
+        self.bulk_filter = bulk_filter
+        self.bulk_update = bulk_update
+        # The namespace the dry-run count was shown for; confirming only ever writes there
+        self.bulk_db = bulk_db
+        self.bulk_coll = bulk_coll
+        self.mongo_handle = None
+        self.last_seen = time.time()
+        self.saved_at = 0.0
+
+    @property
+    def mongo_client(self):
+        return self.mongo_handle.client if self.mongo_handle is not None else None
+
+    def update(self, **fields):
+        for name, value in fields.items():
+            setattr(self, name, value)
+
+    def release(self):
+        if self.mongo_handle is not None:
+            self.mongo_handle.release()
+            self.mongo_handle = None
+
+    def to_record(self):
+        return dumps({name: getattr(self, name) for name in self.PERSISTED})
+
+    @classmethod
+    def from_record(cls, user_id, record, last_seen):
+        # Records written by older versions may carry fields that have since been dropped
+        fields = {name: value for name, value in loads(record).items() if name in cls.PERSISTED}
+        session = cls(user_id, **fields)
+        session.last_seen = session.saved_at = last_seen
+        return session
+
+
+class MemoryBackend:
+    def load(self, user_id):
+        return None
+
+    def save(self, session):
+        pass
+
+    def delete(self, user_id):
+        pass
+
+    def purge(self, older_than):
+        pass
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    # Saves are collected and written in one transaction per flush interval, so a burst of
+    # taps costs one commit instead of one fsync each on the event loop. A crash loses at
+    # most the last interval of state changes.
+    def __init__(self, path=SESSION_PATH, flush_interval=SESSION_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._conn = sqlite3.connect(path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions "
+            "(user_id INTEGER PRIMARY KEY, record TEXT NOT NULL, last_seen REAL NOT NULL)"
+        )
+        self._conn.commit()
+        # Records contain connection URLs, so keep the file private to the bot user
+        os.chmod(path, 0o600)
+        # user_id -> (record, last_seen), or None for a pending delete
+        self._dirty = {}
+        self._flush_handle = None
+
+    def load(self, user_id):
+        if user_id in self._dirty:
+            return self._dirty[user_id]
+        row = self._conn.execute(
+            "SELECT record, last_seen FROM sessions WHERE user_id = ?", (user_id,)
+        ).fetchone()
+        return row
+
+    def _schedule(self):
+        if self._flush_handle is not None:
+            return
+        loop = asyncio.get_event_loop()
+        if not loop.is_running():
+            self.flush()
+            return
+        self._flush_handle = loop.call_later(self.flush_interval, self.flush)
+
+    def flush(self):
+        if self._flush_handle is not None:
+            self._flush_handle.cancel()
+            self._flush_handle = None
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, {}
+        with self._conn:
+            self._conn.executemany(
+                "DELETE FROM sessions WHERE user_id = ?",
+                [(user_id,) for user_id, row in dirty.items() if row is None],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO sessions (user_id, record, last_seen) VALUES (?, ?, ?)",
+                [(user_id,) + row for user_id, row in dirty.items() if row is not None],
+            )
+
+    def save(self, session):
+        self._dirty[session.user_id] = (session.to_record(), session.last_seen)
+        self._schedule()
+
+    def delete(self, user_id):
+        self._dirty[user_id] = None
+        self._schedule()
+
+    def purge(self, older_than):
+        self.flush()
+        self._conn.execute("DELETE FROM sessions WHERE last_seen < ?", (older_than,))
+        self._conn.commit()
+
+    def close(self):
+        self.flush()
+        self._conn.close()
+
+
+def create_backend(kind=SESSION_BACKEND, path=SESSION_PATH):
+    if kind == "sqlite":
+        return SQLiteBackend(path)
+    if kind == "memory":
+        return MemoryBackend()
+    raise ValueError(f"Unknown session backend: {kind}")
+
+
+class SessionStore:
+    def __init__(self, backend=None, max_active=SESSION_MAX_ACTIVE, ttl=SESSION_TTL,
+                 sweep_interval=SESSION_SWEEP_INTERVAL):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.max_active = max_active
+        self.ttl = ttl
+        self.sweep_interval = sweep_interval
+        self._sessions = OrderedDict()
+        self._sweep_task = None
+
+    def __contains__(self, user_id):
+        return self.get(user_id) is not None
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def get(self, user_id):
+        now = time.time()
+        session = self._sessions.get(user_id)
+        if session is None:
+            row = self.backend.load(user_id)
+            if row is None:
+                return None
+            session = Session.from_record(user_id, *row)
+        if now - session.last_seen >= self.ttl:
+            self.remove(user_id)
+            return None
+        session.last_seen = now
+        self._activate(session)
+        # Keep the persisted timestamp from falling behind, or the sweep would purge live sessions
+        if now - session.saved_at >= self.ttl / 4:
+            self.save(session)
+        return session
+
+    def create(self, user_id, **fields):
+        self.remove(user_id)
+        session = Session(user_id, **fields)
+        self._activate(session)
+        self.save(session)
+        return session
+
+    def save(self, session):
+        session.saved_at = session.last_seen
+        self.backend.save(session)
+
+    def update(self, session, **fields):
+        session.update(**fields)
+        self.save(session)
+
+    def remove(self, user_id):
+        session = self._sessions.pop(user_id, None)
+        if session is not None:
+            session.release()
+        self.backend.delete(user_id)
+
+    def _activate(self, session):
+        self._sessions[session.user_id] = session
+        self._sessions.move_to_end(session.user_id)
+        while len(self._sessions) > self.max_active:
+            # Least recently used sessions leave memory but stay restorable from the backend
+            _, evicted = self._sessions.popitem(last=False)
+            evicted.release()
+            self.save(evicted)
+
+    def sweep(self):
+        cutoff = time.time() - self.ttl
+        for user_id, session in list(self._sessions.items()):
+            if session.last_seen < cutoff:
+                del self._sessions[user_id]
+                session.release()
+        self.backend.purge(cutoff)
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            self.sweep()
+
+    def start(self):
+        if self._sweep_task is None:
+            self._sweep_task = asyncio.ensure_future(self._sweep_loop())
+
+    def close(self):
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        for session in self._sessions.values():
+            session.release()
+            self.save(session)
+        self._sessions.clear()
+        self.backend.close()
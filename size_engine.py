@@ -0,0 +1,73 @@
+import asyncio
+import os
+from collections import Counter
+
+from pymongo.errors import ExecutionTimeout, OperationFailure
+
+from namespace_cache import NamespaceCache
+
+SIZE_CACHE_TTL = int(os.environ.get("SIZE_CACHE_TTL", 300))
+SIZE_CACHE_MAX_ENTRIES = int(os.environ.get("SIZE_CACHE_MAX_ENTRIES", 1024))
+SIZE_MAX_TIME_MS = int(os.environ.get("SIZE_MAX_TIME_MS", 60000))
+
+STORAGE_FIELDS = ("count", "size", "storageSize", "totalIndexSize", "nindexes")
+
+
+async def sum_field(collection, field="file_size", max_time_ms=SIZE_MAX_TIME_MS):
+    # $sum ignores non-numeric values, so documents with a malformed size don't break the total.
+    # Returns (None, None) when the scan can't finish within max_time_ms.
+    pipeline = [
+        {"$match": {field: {"$exists": True}}},
+        {"$group": {"_id": None, "total": {"$sum": f"${field}"}, "files": {"$sum": 1}}},
+    ]
+    cursor = collection.aggregate(pipeline, maxTimeMS=max_time_ms)
+    try:
+        result = await cursor.to_list(length=1)
+    except ExecutionTimeout:
+        return None, None
+    if not result:
+        return 0, 0
+    return result[0]["total"], result[0]["files"]
+
+
+async def storage_stats(collection):
+    # Totals over STORAGE_FIELDS plus per-index sizes in "indexSizes", or None when the
+    # server won't say
+    stats = dict.fromkeys(STORAGE_FIELDS, 0)
+    stats["indexSizes"] = Counter()
+    try:
+        # One document per shard on sharded clusters, a single one otherwise
+        cursor = collection.aggregate([{"$collStats": {"storageStats": {}}}])
+        for shard in await cursor.to_list(length=None):
+            shard_stats = shard.get("storageStats", {})
+            for field in STORAGE_FIELDS:
+                stats[field] += shard_stats.get(field, 0)
+            stats["indexSizes"].update(shard_stats.get("indexSizes", {}))
+        return stats
+    except OperationFailure:
+        pass
+    try:
+        # Servers without $collStats (or views) still answer the legacy command
+        result = await collection.database.command("collStats", collection.name)
+    except OperationFailure:
+        return None
+    for field in STORAGE_FIELDS:
+        stats[field] = result.get(field, 0)
+    stats["indexSizes"].update(result.get("indexSizes", {}))
+    return stats
+
+
+class SizeEngine(NamespaceCache):
+    def __init__(self, ttl=SIZE_CACHE_TTL, max_entries=SIZE_CACHE_MAX_ENTRIES, field="file_size"):
+        super().__init__(ttl, max_entries)
+        self.field = field
+
+    async def get(self, cluster_key, collection, refresh=False):
+        return await self.get_or_compute(self.key(cluster_key, collection), lambda: self._compute(collection), refresh)
+
+    async def _compute(self, collection):
+        (total, files), stats = await asyncio.gather(
+            sum_field(collection, self.field),
+            storage_stats(collection),
+        )
+        return {"total": total, "files": files, "stats": stats}
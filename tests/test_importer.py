@@ -0,0 +1,108 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import bson
+import pytest
+
+import importer
+from importer import JsonStreamReader, import_file
+
+
+def write(tmp_path, text):
+    path = tmp_path / "input.json"
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def read_all(path, batch_size=1000):
+    reader = JsonStreamReader(path)
+    documents, errors = [], []
+    try:
+        while not reader.done:
+            batch, batch_errors = reader.read_batch(batch_size)
+            documents += batch
+            errors += batch_errors
+    finally:
+        reader.close()
+    return documents, errors
+
+
+def test_jsonl_bad_rows_are_skipped_without_refilling(tmp_path, monkeypatch):
+    lines = []
+    for i in range(20000):
+        lines.append('{"n": %d, oops}' % i if i % 10 == 0 else json.dumps({"n": i}))
+    path = write(tmp_path, "\n".join(lines) + "\n")
+    monkeypatch.setattr(importer, "IMPORT_READ_SIZE", 1024)
+    copied = []
+    original = JsonStreamReader._fill
+
+    def fill(self):
+        original(self)
+        copied.append(len(self._buffer))
+    monkeypatch.setattr(JsonStreamReader, "_fill", fill)
+
+    documents, errors = read_all(path)
+
+    assert [document["n"] for document in documents] == [i for i in range(20000) if i % 10]
+    assert [record for record, _ in errors] == list(range(1, 20001, 10))
+    # Each refill copies the unread buffer; a bad row must not pull the rest of the file in
+    assert sum(copied) < 4 * len("\n".join(lines))
+
+
+def test_minified_array_keeps_elements_after_a_bad_one(tmp_path):
+    path = write(tmp_path, '[{"a": 1},{"b": [1, {"c": "x,]"}], bad},{"c": 3},4,{"d": "\\"}"}]')
+
+    documents, errors = read_all(path)
+
+    assert documents == [{"a": 1}, {"c": 3}, {"d": '"}'}]
+    assert [record for record, _ in errors] == [2, 4]
+    assert errors[1][1] == "not a JSON object"
+
+
+@pytest.mark.parametrize("read_size", [1, 7, 64])
+def test_records_spanning_buffer_boundaries(tmp_path, monkeypatch, read_size):
+    monkeypatch.setattr(importer, "IMPORT_READ_SIZE", read_size)
+    expected = [
+        {"name": "x" * 100, "nested": {"values": list(range(20)), "flag": True}},
+        {"_id": {"$oid": "5f1d7f5e9b1e8b3a4c2d6e7f"}, "escaped": "tab\\t and \\u00e9", "n": -12.5e3},
+        {"empty": {}, "null": None},
+    ]
+    array = json.dumps(expected, indent=2)
+    lines = "\n".join(json.dumps(document) for document in expected)
+
+    for text in (array, lines):
+        documents, errors = read_all(write(tmp_path, text))
+        assert errors == []
+        assert len(documents) == 3
+        assert documents[0] == expected[0]
+        assert documents[1]["_id"] == bson.ObjectId("5f1d7f5e9b1e8b3a4c2d6e7f")
+        assert documents[1]["n"] == -12500.0
+        assert documents[2] == expected[2]
+
+
+class EncodingCollection:
+    # Encodes like the driver does, so unencodable documents fail the whole batch
+    def __init__(self):
+        self.documents = []
+
+    async def insert_many(self, documents, ordered=True):
+        for document in documents:
+            bson.encode(document)
+        self.documents += documents
+        return SimpleNamespace(inserted_ids=[None] * len(documents))
+
+
+def test_unencodable_documents_are_counted_and_the_rest_inserted(tmp_path):
+    rows = [json.dumps({"n": i}) for i in range(5000)]
+    rows.insert(1234, json.dumps({"n": 2 ** 70}))
+    path = write(tmp_path, "\n".join(rows))
+    collection = EncodingCollection()
+
+    summary = asyncio.get_event_loop().run_until_complete(import_file(collection, path))
+
+    assert summary["read"] == 5001
+    assert summary["inserted"] == 5000
+    assert summary["failed"] == 1
+    assert list(summary["errors"]) == ["invalid document"]
+    assert len(collection.documents) == 5000